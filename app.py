@@ -1,36 +1,501 @@
-from flask import Flask, render_template, request, redirect, url_for, g
+from flask import Flask, Response, render_template, stream_template, request, redirect, url_for, g, has_request_context
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+import click
+import csv
+import io
+import json
+import logging
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
 from pathlib import Path
 from datetime import datetime, timedelta
 
 app = Flask(__name__)
 DB_PATH = Path(__file__).with_name("library.db")
 
-# ---- KẾT NỐI DB ----
-SCHEMA_READY = False  # chỉ init/migrate một lần mỗi lần app khởi động
+# ---- METRICS (Prometheus) ----
+# Histogram theo endpoint: thời gian request và số query SQL mỗi request (bắt N+1).
+# Ghi nhận một lần mỗi request dưới một khoá; query chỉ cộng vào bộ đếm trên connection.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+SLOW_QUERY_MS = float(os.environ.get("LIBRARY_SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG_SIZE = 100
+
+slow_query_logger = logging.getLogger("library.slow_query")
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)   # không cộng dồn; cộng dồn khi xuất
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        out, cumulative = [], 0
+        for le, c in zip(self.buckets, self.counts):
+            cumulative += c
+            out.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        out.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        out.append(f"{name}_sum{{{labels}}} {self.sum:.6f}")
+        out.append(f"{name}_count{{{labels}}} {self.count}")
+        return out
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}          # (endpoint, method, status) -> count
+        self.latency = {}           # (endpoint, method) -> Histogram (giây)
+        self.queries = {}           # endpoint -> Histogram (số query / request)
+        self.sql_seconds = {}       # endpoint -> tổng thời gian SQL
+        self.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        self.slow_total = 0
+
+    def observe_request(self, endpoint, method, status, seconds, query_count, query_seconds):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            hist = self.latency.get((endpoint, method))
+            if hist is None:
+                hist = self.latency[(endpoint, method)] = Histogram(LATENCY_BUCKETS)
+            hist.observe(seconds)
+            hist = self.queries.get(endpoint)
+            if hist is None:
+                hist = self.queries[endpoint] = Histogram(QUERY_COUNT_BUCKETS)
+            hist.observe(query_count)
+            self.sql_seconds[endpoint] = self.sql_seconds.get(endpoint, 0.0) + query_seconds
+
+    def observe_slow_query(self, sql, seconds):
+        endpoint = _endpoint_label() if has_request_context() else "<cli>"
+        entry = {"at": datetime.now().isoformat(timespec="seconds"), "ms": round(seconds * 1000, 3),
+                 "endpoint": endpoint, "sql": " ".join(sql.split())[:500]}
+        with self._lock:
+            self.slow_queries.append(entry)
+            self.slow_total += 1
+        slow_query_logger.warning("slow query %.1f ms [%s]: %s", entry["ms"], endpoint, entry["sql"])
+
+    def render(self, pool_stats: dict) -> str:
+        out = []
+        def header(name, kind, text):
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+        with self._lock:
+            header("library_http_requests_total", "counter", "Số request theo endpoint, method, status.")
+            for (ep, method, status), c in sorted(self.requests.items()):
+                out.append(f'library_http_requests_total{{endpoint="{ep}",method="{method}",status="{status}"}} {c}')
+            header("library_http_request_duration_seconds", "histogram", "Thời gian xử lý request.")
+            for (ep, method), hist in sorted(self.latency.items()):
+                out.extend(hist.lines("library_http_request_duration_seconds", f'endpoint="{ep}",method="{method}"'))
+            header("library_sql_queries_per_request", "histogram", "Số query SQL trong một request.")
+            for ep, hist in sorted(self.queries.items()):
+                out.extend(hist.lines("library_sql_queries_per_request", f'endpoint="{ep}"'))
+            header("library_sql_duration_seconds_total", "counter", "Tổng thời gian chạy SQL (execute + fetch).")
+            for ep, secs in sorted(self.sql_seconds.items()):
+                out.append(f'library_sql_duration_seconds_total{{endpoint="{ep}"}} {secs:.6f}')
+            header("library_sql_slow_queries_total", "counter", f"Số query chậm hơn {SLOW_QUERY_MS:g} ms.")
+            out.append(f"library_sql_slow_queries_total {self.slow_total}")
+        for key, kind in (("size", "gauge"), ("in_use", "gauge"), ("peak_in_use", "gauge"),
+                          ("acquires", "counter"), ("waits", "counter"), ("timeouts", "counter"),
+                          ("utilization", "gauge")):
+            name = f"library_db_pool_{key}" + ("_total" if kind == "counter" else "")
+            header(name, kind, f"Connection pool: {key}.")
+            out.append(f"{name} {pool_stats[key]}")
+        header("library_db_pool_wait_seconds_total", "counter", "Tổng thời gian chờ connection.")
+        out.append(f"library_db_pool_wait_seconds_total {pool_stats['wait_total_ms'] / 1000:.6f}")
+        return "\n".join(out) + "\n"
+
+METRICS = Metrics()
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Đếm và đo thời gian execute + fetch*, cộng vào connection."""
+
+    def _timed(self, fn, *args, new_query=False):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - t0
+            conn = self.connection
+            if new_query:
+                conn.query_count += 1
+                self._sql, self._elapsed, self._logged = args[0], 0.0, False
+            conn.query_time += elapsed
+            self._elapsed += elapsed
+            if not self._logged and self._elapsed * 1000 >= SLOW_QUERY_MS:
+                self._logged = True
+                METRICS.observe_slow_query(self._sql, self._elapsed)
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters, new_query=True)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters, new_query=True)
+
+    def fetchone(self):
+        return self._timed(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        return self._timed(super().fetchall)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection có bộ đếm query; get_db() reset mỗi request, teardown đọc ra."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.query_count = 0
+        self.query_time = 0.0
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # bản C của Connection.execute gọi thẳng Cursor.execute gốc → đi qua cursor() để được đo
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def _endpoint_label():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "<unmatched>"
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _remember_status(resp):
+    g.response_status = resp.status_code
+    return resp
+
+def note_queries(count, seconds):
+    """Cộng query chạy trên connection ngoài pool (vd. cache danh mục) vào số đo của request."""
+    if has_request_context():
+        g.extra_query_count = g.get("extra_query_count", 0) + count
+        g.extra_query_time = g.get("extra_query_time", 0.0) + seconds
+
+def _request_queries(ctx, db):
+    """(số query, thời gian query) của request: connection của request + note_queries()."""
+    count, seconds = ctx.get("extra_query_count", 0), ctx.get("extra_query_time", 0.0)
+    if db is not None:
+        count, seconds = count + db.query_count, seconds + db.query_time
+    return count, seconds
+
+@app.teardown_request
+def _record_request(exc=None):
+    # chạy trước khi connection về pool (close_db là teardown_appcontext, chạy sau)
+    if g.get("streaming"):
+        return
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    METRICS.observe_request(
+        _endpoint_label(), request.method,
+        500 if exc is not None else g.get("response_status", 500),
+        time.perf_counter() - started,
+        *_request_queries(g, g.get("db")),
+    )
+
+def streamed(resp):
+    """Response stream: Flask chạy teardown ngay khi view trả về, trước khi body
+    được sinh. Giữ connection và số đo của request tới khi response đóng (gửi
+    xong hoặc client bỏ giữa chừng)."""
+    g.streaming = True
+    db, started = g.get("db"), g.get("request_started")
+    endpoint, method = _endpoint_label(), request.method
+    ctx = g._get_current_object()   # body stream còn cộng thêm query qua note_queries()
+
+    def finish():
+        if started is not None:
+            METRICS.observe_request(
+                endpoint, method, resp.status_code, time.perf_counter() - started,
+                *_request_queries(ctx, db),
+            )
+        if db is not None:
+            get_pool().release(db)
+
+    resp.call_on_close(finish)
+    return resp
+
+@app.get("/metrics")
+def metrics():
+    return Response(METRICS.render(get_pool().stats()), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/metrics/slow-queries")
+def slow_queries():
+    return {"threshold_ms": SLOW_QUERY_MS, "queries": list(METRICS.slow_queries)}
+
+# ---- KẾT NỐI DB (pool) ----
+POOL_SIZE = int(os.environ.get("LIBRARY_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("LIBRARY_DB_POOL_TIMEOUT", "10"))
+
+# Cấu hình MỘT lần khi mở connection, không lặp lại mỗi request.
+# WAL: reader không chặn writer (và ngược lại).
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -16000",      # ~16 MB page cache / connection
+    "PRAGMA mmap_size = 268435456",    # 256 MB
+)
+
+class PoolTimeout(Exception):
+    """Hết thời gian chờ connection rảnh trong pool."""
+
+class ConnectionPool:
+    """Pool SQLite có giới hạn, an toàn đa luồng.
+
+    Connection được tạo lười tới tối đa `size`, cấu hình PRAGMA một lần và
+    giữ statement cache giữa các request. Thống kê thời gian chờ và mức sử
+    dụng để chọn kích thước pool khi chạy server đa luồng.
+    """
+
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()   # LIFO: dùng lại connection "nóng"
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._acquires = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._started = self._last_change = time.perf_counter()
+        self._in_use_area = 0.0          # tích phân in_use theo thời gian
+
+    def connect(self):
+        """Connection mới cấu hình như của pool nhưng không thuộc pool (cache, writer giữ riêng)."""
+        db = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256,
+                             factory=InstrumentedConnection)
+        db.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            db.execute(pragma)
+        return db
+
+    def _track(self, delta):
+        # gọi khi đang giữ self._lock
+        now = time.perf_counter()
+        self._in_use_area += self._in_use * (now - self._last_change)
+        self._last_change = now
+        self._in_use += delta
+        self._peak_in_use = max(self._peak_in_use, self._in_use)
+
+    def acquire(self):
+        t0 = time.perf_counter()
+        db = None
+        try:
+            db = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    db = self.connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+        waited = False
+        if db is None:
+            waited = True
+            try:
+                db = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._timeouts += 1
+                raise PoolTimeout(f"không có connection rảnh sau {self.timeout}s") from None
+        wait = time.perf_counter() - t0
+        with self._lock:
+            self._acquires += 1
+            self._waits += waited
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self._track(+1)
+        return db
+
+    def release(self, db):
+        if db.in_transaction:
+            db.rollback()   # không để transaction dở dang lọt sang request sau
+        with self._lock:
+            self._track(-1)
+        self._idle.put(db)
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.perf_counter()
+            area = self._in_use_area + self._in_use * (now - self._last_change)
+            elapsed = max(now - self._started, 1e-9)
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "peak_in_use": self._peak_in_use,
+                "acquires": self._acquires,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "wait_total_ms": round(self._wait_total * 1000, 3),
+                "wait_avg_ms": round(self._wait_total * 1000 / self._acquires, 3) if self._acquires else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+                "utilization": round(area / (elapsed * self.size), 4),
+            }
+
+POOL = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    global POOL
+    if POOL is None:
+        with _POOL_LOCK:
+            if POOL is None:
+                pool = ConnectionPool(DB_PATH)
+                db = pool.acquire()
+                try:
+                    migrate(db)   # một lần mỗi process, trước khi pool được dùng
+                    ensure_unique_books_index(db)
+                finally:
+                    pool.release(db)
+                POOL = pool
+    return POOL
 
 def get_db():
     db = getattr(g, "db", None)
     if db is None:
-        db = sqlite3.connect(DB_PATH)
-        db.row_factory = sqlite3.Row
-        db.execute("PRAGMA foreign_keys = ON")
+        db = get_pool().acquire()
+        db.query_count, db.query_time = 0, 0.0   # bộ đếm cho request này
         g.db = db
-
-        global SCHEMA_READY
-        if not SCHEMA_READY:
-            ensure_schema(db)   # tạo bảng, migrate cột, seed mẫu
-            SCHEMA_READY = True
     return db
 
 @app.teardown_appcontext
 def close_db(exc=None):
+    if g.get("streaming"):
+        return      # connection còn dùng cho body stream, streamed() sẽ trả về pool
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        get_pool().release(db)
+
+@app.errorhandler(PoolTimeout)
+def pool_timeout(exc):
+    return "Máy chủ đang bận, thử lại sau", 503
+
+@app.get("/pool/stats")
+def pool_stats():
+    return get_pool().stats()
+
 # ---- SCHEMA & SEED ----
-def ensure_schema(db: sqlite3.Connection):
-    # bảng sách
+FTS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author)
+        VALUES ('delete', old.id, old.title, old.author);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author ON books BEGIN
+        INSERT INTO books_fts(books_fts, rowid, title, author)
+        VALUES ('delete', old.id, old.title, old.author);
+        INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author);
+    END""",
+)
+
+# Bảng tổng hợp cho báo cáo mượn/trả, trigger cập nhật theo từng dòng loans → báo cáo
+# đọc vài dòng thay vì GROUP BY cả lịch sử. Số liệu là lịch sử chỉ-cộng: xoá loan (khi
+# xoá sách) không trừ ngược lượt mượn/trả đã ghi, chỉ bỏ loan đang mở khỏi active_loans.
+LOAN_STATS_TABLES = (
+    """CREATE TABLE IF NOT EXISTS borrower_stats(
+        borrower_name TEXT PRIMARY KEY,
+        active_loans INTEGER NOT NULL DEFAULT 0,
+        total_loans INTEGER NOT NULL DEFAULT 0,
+        last_borrowed_at TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS loan_daily(
+        day TEXT PRIMARY KEY,
+        borrowed INTEGER NOT NULL DEFAULT 0,
+        returned INTEGER NOT NULL DEFAULT 0
+    )""",
+)
+LOAN_STATS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS loans_stats_ai AFTER INSERT ON loans BEGIN
+        INSERT INTO borrower_stats(borrower_name, active_loans, total_loans, last_borrowed_at)
+        VALUES (new.borrower_name, new.returned_at IS NULL, 1, new.borrowed_at)
+        ON CONFLICT(borrower_name) DO UPDATE SET
+            active_loans = active_loans + excluded.active_loans,
+            total_loans = total_loans + 1,
+            last_borrowed_at = max(coalesce(last_borrowed_at, ''), excluded.last_borrowed_at);
+        INSERT INTO loan_daily(day, borrowed) VALUES (substr(new.borrowed_at, 1, 10), 1)
+        ON CONFLICT(day) DO UPDATE SET borrowed = borrowed + 1;
+        INSERT INTO loan_daily(day, returned)
+        SELECT substr(new.returned_at, 1, 10), 1 WHERE new.returned_at IS NOT NULL
+        ON CONFLICT(day) DO UPDATE SET returned = returned + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS loans_stats_return AFTER UPDATE OF returned_at ON loans
+    WHEN old.returned_at IS NULL AND new.returned_at IS NOT NULL BEGIN
+        UPDATE borrower_stats SET active_loans = active_loans - 1
+        WHERE borrower_name = new.borrower_name;
+        INSERT INTO loan_daily(day, returned) VALUES (substr(new.returned_at, 1, 10), 1)
+        ON CONFLICT(day) DO UPDATE SET returned = returned + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS loans_stats_ad AFTER DELETE ON loans
+    WHEN old.returned_at IS NULL BEGIN
+        UPDATE borrower_stats SET active_loans = active_loans - 1
+        WHERE borrower_name = old.borrower_name;
+    END""",
+)
+
+# Bộ đếm thay đổi của books (trigger theo dòng): cache danh mục biết sách có đổi hay
+# chỉ loan đổi mà không phải đọc lại cả bảng.
+CATALOG_VERSION_TRIGGERS = tuple(
+    f"""CREATE TRIGGER IF NOT EXISTS books_version_{name} AFTER {event} ON books BEGIN
+        UPDATE catalog_version SET books = books + 1;
+    END"""
+    for name, event in (("ai", "INSERT"), ("ad", "DELETE"), ("au", "UPDATE"))
+)
+
+def backfill_loan_stats(db):
+    """Dựng lại bảng tổng hợp từ toàn bộ loans (một lần, khi mới tạo bảng)."""
+    db.execute("DELETE FROM borrower_stats")
+    db.execute("DELETE FROM loan_daily")
+    db.execute("""
+        INSERT INTO borrower_stats(borrower_name, active_loans, total_loans, last_borrowed_at)
+        SELECT borrower_name, SUM(returned_at IS NULL), COUNT(*), MAX(borrowed_at)
+        FROM loans GROUP BY borrower_name
+    """)
+    db.execute("""
+        INSERT INTO loan_daily(day, borrowed, returned)
+        SELECT day, SUM(borrowed), SUM(returned) FROM (
+            SELECT substr(borrowed_at, 1, 10) AS day, 1 AS borrowed, 0 AS returned FROM loans
+            UNION ALL
+            SELECT substr(returned_at, 1, 10), 0, 1 FROM loans WHERE returned_at IS NOT NULL
+        ) GROUP BY day
+    """)
+
+# Mỗi bước là một hàm idempotent, chạy đúng một lần theo thứ tự; PRAGMA user_version
+# lưu số bước đã chạy. DB tạo từ bản cũ (user_version = 0, bảng đã có) vẫn chạy lại
+# an toàn nhờ IF NOT EXISTS / kiểm tra trước khi sửa.
+def _m001_base_tables(db):
     db.execute("""
         CREATE TABLE IF NOT EXISTS books(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -39,7 +504,6 @@ def ensure_schema(db: sqlite3.Connection):
             year INTEGER NOT NULL
         )
     """)
-    # bảng mượn
     db.execute("""
         CREATE TABLE IF NOT EXISTS loans(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -52,16 +516,15 @@ def ensure_schema(db: sqlite3.Connection):
         )
     """)
 
-    # migrate cột mới cho bảng books (nếu thiếu)
+def _m002_book_location_columns(db):
     cols = [r["name"] for r in db.execute("PRAGMA table_info(books)").fetchall()]
     if "shelf_code" not in cols:
         db.execute("ALTER TABLE books ADD COLUMN shelf_code TEXT")
     if "location_url" not in cols:
         db.execute("ALTER TABLE books ADD COLUMN location_url TEXT")
 
-    # seed nếu trống
-    count = db.execute("SELECT COUNT(*) AS c FROM books").fetchone()["c"]
-    if count == 0:
+def _m003_seed_sample_books(db):
+    if db.execute("SELECT 1 FROM books LIMIT 1").fetchone() is None:
         db.executemany(
             "INSERT INTO books(title, author, year, shelf_code, location_url) VALUES (?,?,?,?,?)",
             [
@@ -70,8 +533,8 @@ def ensure_schema(db: sqlite3.Connection):
             ],
         )
 
-    # --- CHỈ tạo UNIQUE index khi KHÔNG còn dữ liệu trùng ---
-    has_dupes = db.execute("""
+def _has_duplicate_books(db) -> bool:
+    return db.execute("""
         SELECT 1
         FROM (
             SELECT title, author, year, COUNT(*) AS c
@@ -81,13 +544,142 @@ def ensure_schema(db: sqlite3.Connection):
         ) LIMIT 1
     """).fetchone() is not None
 
-    if not has_dupes:
-        db.execute(
-            "CREATE UNIQUE INDEX IF NOT EXISTS idx_books_unique "
-            "ON books(title, author, year)"
-        )
+def _create_unique_books_index(db):
+    db.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_books_unique "
+        "ON books(title, author, year)"
+    )
+
+def _m004_unique_books_index(db):
+    # CHỈ tạo UNIQUE index khi KHÔNG còn dữ liệu trùng (DB cũ có thể đã có bản trùng;
+    # khi đó app vẫn chặn trùng ở tầng ứng dụng, import báo dedupe_index = false).
+    # Bước bị bỏ qua được ensure_unique_books_index() thử lại mỗi lần khởi động.
+    if _has_duplicate_books(db):
+        app.logger.warning("books có bản trùng (title, author, year): bỏ qua idx_books_unique")
+    else:
+        _create_unique_books_index(db)
+
+def _m005_books_fts(db):
+    # full-text search: bảng FTS5 external-content, đồng bộ bằng trigger
+    has_fts = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='books_fts'"
+    ).fetchone() is not None
+    if not has_fts:
+        db.execute("""
+            CREATE VIRTUAL TABLE books_fts USING fts5(
+                title, author,
+                content='books', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        """)
+        db.execute("INSERT INTO books_fts(books_fts) VALUES('rebuild')")
+    for trigger in FTS_TRIGGERS:
+        db.execute(trigger)
+
+def _m006_open_loans_index(db):
+    # partial index: chỉ chứa loan đang mở → tra "loan hiện tại" theo book_id không phải quét bảng
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_loans_open "
+        "ON loans(book_id) WHERE returned_at IS NULL"
+    )
+
+def _m007_loan_reports(db):
+    # quá hạn = loan đang mở có due_at < hôm nay: index chỉ lớn theo số loan đang mở
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_loans_overdue "
+        "ON loans(due_at) WHERE returned_at IS NULL"
+    )
+    # bảng tổng hợp + trigger; tạo lần đầu thì backfill từ lịch sử
+    has_stats = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='borrower_stats'"
+    ).fetchone() is not None
+    for stmt in LOAN_STATS_TABLES + LOAN_STATS_TRIGGERS:
+        db.execute(stmt)
+    if not has_stats:
+        backfill_loan_stats(db)
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_borrower_stats_active "
+        "ON borrower_stats(active_loans DESC, borrower_name) WHERE active_loans > 0"
+    )
 
-    db.commit()
+def _m008_catalog_version(db):
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS catalog_version("
+        "id INTEGER PRIMARY KEY CHECK (id = 1), books INTEGER NOT NULL)"
+    )
+    db.execute("INSERT OR IGNORE INTO catalog_version(id, books) VALUES (1, 0)")
+    for trigger in CATALOG_VERSION_TRIGGERS:
+        db.execute(trigger)
+
+def _m009_append_only_loan_stats(db):
+    # loans_stats_ad cũ trừ lượt mượn/trả khi xoá sách (cascade xoá loan) → viết lại lịch sử
+    db.execute("DROP TRIGGER IF EXISTS loans_stats_ad")
+    db.execute(next(t for t in LOAN_STATS_TRIGGERS if "loans_stats_ad" in t))
+
+# Chỉ THÊM bước mới vào cuối; không sửa/xoá bước đã phát hành.
+MIGRATIONS = (
+    _m001_base_tables,
+    _m002_book_location_columns,
+    _m003_seed_sample_books,
+    _m004_unique_books_index,
+    _m005_books_fts,
+    _m006_open_loans_index,
+    _m007_loan_reports,
+    _m008_catalog_version,
+    _m009_append_only_loan_stats,
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def schema_version(db) -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(db: sqlite3.Connection) -> tuple:
+    """Chạy các bước còn thiếu, mỗi bước một transaction cùng với việc tăng user_version.
+
+    BEGIN IMMEDIATE giữ khoá ghi nên nhiều process khởi động cùng lúc không chạy
+    trùng bước: process sau chờ, đọc lại version trong transaction rồi bỏ qua.
+    Trả (version trước, version sau) của các bước do lần gọi này chạy.
+    DB đã mới nhất: chỉ tốn một PRAGMA.
+    """
+    current = schema_version(db)
+    if current > SCHEMA_VERSION:
+        raise RuntimeError(f"DB ở schema v{current}, mới hơn app (v{SCHEMA_VERSION})")
+    before = None
+    while schema_version(db) < SCHEMA_VERSION:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(db)
+            if version < SCHEMA_VERSION:
+                MIGRATIONS[version](db)
+                db.execute(f"PRAGMA user_version = {version + 1}")
+                before = version if before is None else before
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+    return (SCHEMA_VERSION if before is None else before), SCHEMA_VERSION
+
+def ensure_unique_books_index(db) -> bool:
+    """Tạo idx_books_unique nếu _m004 đã phải bỏ qua vì DB có bản trùng lúc migrate.
+
+    Gọi sau migrate() mỗi lần khởi động; index đã có thì chỉ tốn một lookup
+    sqlite_master. Còn bản trùng: cảnh báo và trả False (cách xử lý: README,
+    mục "Sách trùng").
+    """
+    if db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_books_unique'"
+    ).fetchone() is not None:
+        return True
+    if _has_duplicate_books(db):
+        app.logger.warning(
+            "books vẫn có bản trùng (title, author, year): chưa có idx_books_unique, "
+            "import không chống trùng ở DB; xoá bản trùng (README: Sách trùng) rồi khởi động lại"
+        )
+        return False
+    with db:
+        _create_unique_books_index(db)
+    return True
 
 # ---- HELPERS ----
 def get_current_loan(db, book_id: int):
@@ -99,65 +691,552 @@ def get_current_loan(db, book_id: int):
         (book_id,),
     ).fetchone()
 
-# ---- ROUTES ----
-@app.get("/")
-def home():
-    db = get_db()
-    rows = db.execute(
-        "SELECT id, title, author, year, shelf_code, location_url FROM books ORDER BY id"
-    ).fetchall()
+def parse_book(data):
+    """Chuẩn hoá 1 bản ghi sách (form/dict) -> tuple theo BOOK_COLUMNS, hoặc None nếu thiếu/sai."""
+    def text(key):
+        v = data.get(key)
+        return str(v).strip() if v is not None else ""
 
-    books = []
-    for r in rows:
-        b = dict(r)
-        loan = get_current_loan(db, r["id"])
-        b["current_loan"] = dict(loan) if loan else None
-        books.append(b)
+    title, author = text("title"), text("author")
+    try:
+        year = int(text("year"))
+    except ValueError:
+        return None
+    if not title or not author:
+        return None
+    return (title, author, year, text("shelf_code") or None, text("location_url") or None)
 
-    return render_template("home.html", books=books)
+# ---- NHẬP HÀNG LOẠT (CSV / JSONL) ----
+BOOK_COLUMNS = ("title", "author", "year", "shelf_code", "location_url")
+IMPORT_BATCH_SIZE = 5000
+IMPORT_FORMATS = ("csv", "jsonl")
 
-@app.post("/books/add")
-def add_book():
-    title = (request.form.get("title") or "").strip()
-    author = (request.form.get("author") or "").strip()
-    year_raw = (request.form.get("year") or "").strip()
-    shelf_code = (request.form.get("shelf_code") or "").strip() or None
-    location_url = (request.form.get("location_url") or "").strip() or None
+def read_records(text_stream, fmt: str):
+    """Đọc từng bản ghi (dict) từ stream văn bản; dòng JSON hỏng -> None."""
+    if fmt == "csv":
+        yield from csv.DictReader(text_stream)
+        return
+    for line in text_stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            obj = None
+        yield obj if isinstance(obj, dict) else None
 
+def import_books(db, records, batch_size=IMPORT_BATCH_SIZE) -> dict:
+    """Chèn sách theo lô executemany, mỗi lô một transaction.
+
+    Chống trùng dựa vào idx_books_unique + INSERT OR IGNORE thay vì SELECT từng dòng.
+    Input hỏng giữa chừng (sai UTF-8, CSV lỗi): dừng đọc, vẫn chèn các bản ghi hợp lệ
+    đã đọc và trả thống kê kèm key "error".
+    """
+    sql = (
+        f"INSERT OR IGNORE INTO books({', '.join(BOOK_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(BOOK_COLUMNS))})"
+    )
+    stats = {"read": 0, "inserted": 0, "duplicates": 0, "invalid": 0}
+    t0 = time.perf_counter()
+
+    def flush(batch):
+        with db:   # commit khi thành công, rollback nếu lỗi
+            inserted = db.executemany(sql, batch).rowcount
+        stats["inserted"] += inserted
+        stats["duplicates"] += len(batch) - inserted
+
+    batch = []
     try:
-        year = int(year_raw)
-    except ValueError:
-        year = None
+        for rec in records:
+            stats["read"] += 1
+            book = parse_book(rec) if rec is not None else None
+            if book is None:
+                stats["invalid"] += 1
+                continue
+            batch.append(book)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+    except (UnicodeDecodeError, csv.Error) as exc:
+        stats["error"] = f"không đọc được dữ liệu sau {stats['read']} bản ghi: {exc}"
+    if batch:
+        flush(batch)
 
-    if not title or not author or year is None:
-        return "Thiếu dữ liệu hợp lệ", 400
+    elapsed = time.perf_counter() - t0
+    stats["rejected"] = stats["invalid"] + stats["duplicates"]
+    stats["seconds"] = round(elapsed, 3)
+    stats["rows_per_sec"] = round(stats["read"] / elapsed) if elapsed > 0 else 0
+    stats["dedupe_index"] = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_books_unique'"
+    ).fetchone() is not None
+    return stats
 
-    db = get_db()
-    # chặn trùng ở tầng ứng dụng
+# ---- DANH MỤC (1 query / trang) ----
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Sách + loan đang mở trong MỘT câu query; subquery đi qua idx_loans_open
+CATALOG_COLUMNS = """
+    SELECT b.id, b.title, b.author, b.year, b.shelf_code, b.location_url,
+           l.id AS loan_id, l.borrower_name, l.borrowed_at, l.due_at
+"""
+OPEN_LOAN_JOIN = """
+    LEFT JOIN loans l ON l.id = (
+        SELECT MAX(id) FROM loans
+        WHERE book_id = b.id AND returned_at IS NULL
+    )
+"""
+CATALOG_SELECT = CATALOG_COLUMNS + " FROM books b " + OPEN_LOAN_JOIN
+
+def catalog_row(r) -> dict:
+    """Row của CATALOG_SELECT -> dict sách có key current_loan (hoặc None)."""
+    b = {k: r[k] for k in ("id", "title", "author", "year", "shelf_code", "location_url")}
+    b["current_loan"] = None if r["loan_id"] is None else {
+        "id": r["loan_id"],
+        "borrower_name": r["borrower_name"],
+        "borrowed_at": r["borrowed_at"],
+        "due_at": r["due_at"],
+    }
+    return b
+
+def fetch_catalog_page(db, after_id=None, before_id=None, size=PAGE_SIZE):
+    """Keyset pagination theo id: chi phí phụ thuộc size, không phụ thuộc số sách.
+
+    Trả về (books, has_prev, has_next).
+    """
+    if before_id is not None:
+        # lùi trang: lấy ngược rồi đảo lại
+        rows = db.execute(
+            CATALOG_SELECT + " WHERE b.id < ? ORDER BY b.id DESC LIMIT ?",
+            (before_id, size + 1),
+        ).fetchall()
+        has_prev = len(rows) > size
+        rows = rows[:size][::-1]
+        has_next = True
+    else:
+        rows = db.execute(
+            CATALOG_SELECT + " WHERE b.id > ? ORDER BY b.id LIMIT ?",
+            (after_id or 0, size + 1),
+        ).fetchall()
+        has_next = len(rows) > size
+        rows = rows[:size]
+        has_prev = bool(after_id)
+    return [catalog_row(r) for r in rows], has_prev, has_next
+
+# ---- TÌM KIẾM (FTS5) ----
+SEARCH_SQL = (
+    "WITH hits AS ("
+    "  SELECT rowid AS id, rank FROM books_fts WHERE books_fts MATCH ?"
+    "  ORDER BY rank LIMIT ? OFFSET ?"
+    ")"
+    + CATALOG_COLUMNS + " FROM hits JOIN books b ON b.id = hits.id " + OPEN_LOAN_JOIN
+    + " ORDER BY hits.rank"
+)
+
+def fts_query(q: str):
+    """Chuỗi người dùng -> biểu thức MATCH: mỗi từ là một prefix đã quote, nối AND."""
+    terms = re.findall(r"\w+", q or "")
+    return " ".join(f'"{t}"*' for t in terms) or None
+
+def search_books(db, q: str, page=1, size=PAGE_SIZE):
+    """Kết quả xếp hạng bm25 theo trang. Trả về (books, has_next)."""
+    match = fts_query(q)
+    if match is None:
+        return [], False
+    rows = db.execute(SEARCH_SQL, (match, size + 1, (page - 1) * size)).fetchall()
+    return [catalog_row(r) for r in rows[:size]], len(rows) > size
+
+def iter_catalog(db):
+    """Duyệt toàn bộ danh mục theo cursor, từng dòng một (không fetchall)."""
+    for r in db.execute(CATALOG_SELECT + " ORDER BY b.id"):
+        yield catalog_row(r)
+
+STREAM_CHUNK = 16 * 1024
+
+def _buffered(chunks, size=STREAM_CHUNK):
+    """Gộp các mảnh nhỏ của Jinja thành khối ~size byte trước khi gửi."""
+    buf, n = [], 0
+    for chunk in chunks:
+        buf.append(chunk)
+        n += len(chunk)
+        if n >= size:
+            yield "".join(buf)
+            buf, n = [], 0
+    if buf:
+        yield "".join(buf)
+
+# ---- CACHE DANH MỤC (trong process, kiểm tra bằng PRAGMA data_version) ----
+CATALOG_CACHE = os.environ.get("LIBRARY_CATALOG_CACHE", "1") != "0"
+BOOK_FIELDS = ("id", "title", "author", "year", "shelf_code", "location_url")
+
+class CatalogCache:
+    """Toàn bộ sách + loan đang mở, giữ trong bộ nhớ của process.
+
+    Mỗi lần đọc chỉ chạy `PRAGMA data_version` trên một connection riêng: giá trị
+    đổi khi connection KHÁC commit (writer của process này, import, worker/process
+    khác), nên nhiều worker vẫn nhất quán mà không cần báo nhau. Có thay đổi thì
+    nạp lại loan đang mở (qua idx_loans_open); sách chỉ nạp lại khi
+    catalog_version.books đổi.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._db = None
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._books_version = None
+        self._books = []        # tuple theo BOOK_FIELDS, sắp theo id
+        self._ids = []
+        self._loans = {}        # book_id -> loan đang mở
+        self.checks = self.book_loads = self.loan_loads = 0
+
+    def snapshot(self):
+        """(books, ids, loans) khớp với DB tại thời điểm gọi; không sửa các giá trị trả về."""
+        with self._lock:
+            if self._db is None:
+                self._db = self._connect()
+            db = self._db
+            count, seconds = db.query_count, db.query_time
+            self.checks += 1
+            # đọc version TRƯỚC khi nạp: commit chen giữa chỉ làm lần sau nạp thừa một lần
+            version = db.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._data_version:
+                self._reload()
+                self._data_version = version
+            # query chạy trên connection riêng của cache: tính cho request đang gọi
+            note_queries(db.query_count - count, db.query_time - seconds)
+            return self._books, self._ids, self._loans
+
+    def _reload(self):
+        db = self._db
+        db.execute("BEGIN")     # sách và loan đọc trong cùng một snapshot
+        try:
+            books_version = db.execute("SELECT books FROM catalog_version").fetchone()[0]
+            if books_version != self._books_version:
+                rows = db.execute(
+                    f"SELECT {', '.join(BOOK_FIELDS)} FROM books ORDER BY id"
+                ).fetchall()
+                self._books = [tuple(r) for r in rows]
+                self._ids = [r[0] for r in rows]
+                self._books_version = books_version
+                self.book_loads += 1
+            self._loans = {
+                r["book_id"]: {k: r[k] for k in ("id", "borrower_name", "borrowed_at", "due_at")}
+                for r in db.execute(
+                    "SELECT id, book_id, borrower_name, borrowed_at, due_at "
+                    "FROM loans WHERE returned_at IS NULL ORDER BY id"
+                )
+            }
+            self.loan_loads += 1
+        finally:
+            db.rollback()
+
+    @staticmethod
+    def _book(row, loans) -> dict:
+        b = dict(zip(BOOK_FIELDS, row))
+        b["current_loan"] = loans.get(row[0])
+        return b
+
+    def page(self, after_id=None, before_id=None, size=PAGE_SIZE):
+        """Như fetch_catalog_page nhưng cắt từ bộ nhớ (bisect theo id)."""
+        books, ids, loans = self.snapshot()
+        if before_id is not None:
+            end = bisect_left(ids, before_id)
+            start = max(end - size, 0)
+            has_prev, has_next = start > 0, True
+        else:
+            start = bisect_right(ids, after_id or 0)
+            end = start + size
+            has_prev, has_next = bool(after_id), end < len(ids)
+        return [self._book(r, loans) for r in books[start:end]], has_prev, has_next
+
+    def iter_books(self):
+        books, _, loans = self.snapshot()
+        for r in books:
+            yield self._book(r, loans)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "books": len(self._books),
+                "open_loans": len(self._loans),
+                "checks": self.checks,
+                "book_loads": self.book_loads,
+                "loan_loads": self.loan_loads,
+            }
+
+CATALOG = None
+_CATALOG_LOCK = threading.Lock()
+
+def get_catalog() -> CatalogCache:
+    global CATALOG
+    if CATALOG is None:
+        with _CATALOG_LOCK:
+            if CATALOG is None:
+                CATALOG = CatalogCache(get_pool().connect)   # connection riêng, ngoài pool
+    return CATALOG
+
+SQLITE_MAX_INT = 2**63 - 1
+
+def _int_arg(name, default=None):
+    """Tham số nguyên, kẹp vào miền INTEGER của SQLite (số quá lớn → OverflowError khi bind)."""
+    try:
+        value = int(request.args[name])
+    except (KeyError, ValueError):
+        return default
+    return min(max(value, -SQLITE_MAX_INT - 1), SQLITE_MAX_INT)
+
+# ---- GHI: một luồng writer, gộp commit ----
+# SQLite chỉ cho một writer tại một thời điểm; để các request tự commit thì chúng
+# tranh khoá ghi và dính "database is locked". Ở đây mọi thao tác ghi vào hàng đợi,
+# một luồng writer lấy hết các job đang chờ, chạy chúng trong MỘT transaction
+# (mỗi job một SAVEPOINT để lỗi của job này không kéo job khác) rồi commit một lần.
+WRITE_BATCH_MAX = 256
+WRITE_TIMEOUT = float(os.environ.get("LIBRARY_WRITE_TIMEOUT", "10"))
+
+class WriteTimeout(Exception):
+    """Job ghi không được xử lý xong trong WRITE_TIMEOUT."""
+
+class WriteRejected(Exception):
+    """Job bị từ chối sau khi kiểm tra trong transaction (vd sách đang được mượn)."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+app.register_error_handler(WriteTimeout, pool_timeout)
+
+class WriteQueue:
+    def __init__(self, connect, batch_max=WRITE_BATCH_MAX):
+        self._connect = connect
+        self.batch_max = batch_max
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = self.jobs = self.rejected = self.cancelled = 0
+        self.max_batch = 0
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args) -> Future:
+        """fn(db, *args) chạy trong transaction của writer; Future có kết quả sau khi đã commit."""
+        future = Future()
+        self._jobs.put((fn, args, future))
+        return future
+
+    def _run(self):
+        db = self._connect()
+        while True:
+            batch = [self._jobs.get()]
+            while len(batch) < self.batch_max:
+                try:
+                    batch.append(self._jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self._apply(db, batch)
+
+    def _apply(self, db, batch):
+        results = []
+        cancelled = 0
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            for fn, args, future in batch:
+                if not future.set_running_or_notify_cancel():   # run_write đã bỏ chờ
+                    cancelled += 1
+                    continue
+                db.execute("SAVEPOINT job")
+                try:
+                    results.append((future, fn(db, *args), None))
+                    db.execute("RELEASE job")
+                except Exception as exc:
+                    db.execute("ROLLBACK TO job")
+                    db.execute("RELEASE job")
+                    results.append((future, None, exc))
+            db.commit()
+        except Exception as exc:       # BEGIN/COMMIT lỗi → cả lô thất bại
+            if db.in_transaction:
+                db.rollback()
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for future, result, exc in results:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+        with self._lock:
+            self.batches += 1
+            self.jobs += len(batch) - cancelled
+            self.cancelled += cancelled
+            self.rejected += sum(exc is not None for _, _, exc in results)
+            self.max_batch = max(self.max_batch, len(batch))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": self._jobs.qsize(),
+                "batches": self.batches,
+                "jobs": self.jobs,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+                "avg_batch": round(self.jobs / self.batches, 2) if self.batches else 0.0,
+                "max_batch": self.max_batch,
+            }
+
+WRITER = None
+_WRITER_LOCK = threading.Lock()
+
+def get_writer() -> WriteQueue:
+    global WRITER
+    if WRITER is None:
+        with _WRITER_LOCK:
+            if WRITER is None:
+                WRITER = WriteQueue(get_pool().connect)   # connection riêng, ngoài pool
+    return WRITER
+
+def run_write(fn, *args):
+    """Gửi job ghi và chờ kết quả (đã commit). WriteRejected được ném lại cho route.
+
+    Quá WRITE_TIMEOUT: job còn trong hàng đợi thì bị huỷ (writer bỏ qua) rồi mới báo
+    WriteTimeout; job đã vào transaction của writer thì chờ tới khi xong, để không báo
+    "thử lại sau" cho một thao tác thực ra đã commit.
+    """
+    future = get_writer().submit(fn, *args)
+    try:
+        return future.result(timeout=WRITE_TIMEOUT)
+    except FutureTimeout:
+        if future.cancel():
+            raise WriteTimeout(f"thao tác ghi chưa xong sau {WRITE_TIMEOUT}s") from None
+    return future.result()
+
+# job ghi: chạy trong luồng writer, kiểm tra lại điều kiện ngay trong transaction
+def _tx_add_book(db, book):
+    title, author, year, shelf_code, location_url = book
     exists = db.execute(
         "SELECT 1 FROM books WHERE title=? AND author=? AND year=?",
         (title, author, year),
     ).fetchone()
     if exists:
-        return "Sách đã tồn tại (quy ước: title + author + year là một bản duy nhất).", 400
-
-    db.execute(
+        raise WriteRejected("Sách đã tồn tại (quy ước: title + author + year là một bản duy nhất).")
+    return db.execute(
         "INSERT INTO books(title, author, year, shelf_code, location_url) VALUES (?,?,?,?,?)",
-        (title, author, year, shelf_code, location_url),
-    )
-    db.commit()
-    return redirect(url_for("home"))
+        book,
+    ).lastrowid
 
-@app.post("/books/delete/<int:book_id>")
-def delete_book(book_id: int):
-    db = get_db()
+def _tx_delete_book(db, book_id):
     # không xoá khi đang có loan chưa trả
     if get_current_loan(db, book_id):
-        return "Không thể xoá: sách đang được mượn", 400
-
+        raise WriteRejected("Không thể xoá: sách đang được mượn")
     db.execute("DELETE FROM loans WHERE book_id=?", (book_id,))
     db.execute("DELETE FROM books WHERE id=?", (book_id,))
-    db.commit()
+
+def _tx_borrow_book(db, book_id, borrower, borrowed_at, due_at):
+    if db.execute("SELECT 1 FROM books WHERE id=?", (book_id,)).fetchone() is None:
+        raise WriteRejected("Không tìm thấy sách", 404)
+    if get_current_loan(db, book_id):
+        raise WriteRejected("Sách đang có người mượn")
+    return db.execute(
+        "INSERT INTO loans(book_id, borrower_name, borrowed_at, due_at) VALUES (?,?,?,?)",
+        (book_id, borrower, borrowed_at, due_at),
+    ).lastrowid
+
+def _tx_return_book(db, loan_id, returned_at):
+    return db.execute(
+        "UPDATE loans SET returned_at=? WHERE id=? AND returned_at IS NULL",
+        (returned_at, loan_id),
+    ).rowcount
+
+@app.get("/writer/stats")
+def writer_stats():
+    return get_writer().stats()
+
+@app.get("/catalog/stats")
+def catalog_stats():
+    if not CATALOG_CACHE:
+        return {"enabled": False}
+    return {"enabled": True, **get_catalog().stats()}
+
+# ---- ROUTES ----
+@app.get("/")
+def home():
+    # có cache: không đụng tới DB trừ khi data_version đã đổi
+    catalog = get_catalog() if CATALOG_CACHE else None
+    if request.args.get("stream"):
+        # Stream toàn bộ danh mục: <tr> được gửi dần, không dựng cả trang trong bộ nhớ
+        books = catalog.iter_books() if catalog else iter_catalog(get_db())
+        return streamed(Response(
+            _buffered(stream_template("home.html", books=books, page=None)),
+            mimetype="text/html",
+        ))
+
+    size = min(max(_int_arg("size", PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    after_id, before_id = _int_arg("after"), _int_arg("before")
+    if catalog:
+        books, has_prev, has_next = catalog.page(after_id, before_id, size)
+    else:
+        books, has_prev, has_next = fetch_catalog_page(get_db(), after_id, before_id, size)
+    page = {
+        "size": size,
+        "prev": url_for("home", before=books[0]["id"], size=size) if books and has_prev else None,
+        "next": url_for("home", after=books[-1]["id"], size=size) if books and has_next else None,
+    }
+    return render_template("home.html", books=books, page=page)
+
+@app.get("/search")
+def search():
+    q = (request.args.get("q") or "").strip()
+    size = min(max(_int_arg("size", PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    # OFFSET = (page - 1) * size cũng phải vừa INTEGER của SQLite
+    page_no = min(max(_int_arg("page", 1), 1), SQLITE_MAX_INT // size)
+    books, has_next = search_books(get_db(), q, page=page_no, size=size)
+    page = {
+        "size": size,
+        "prev": url_for("search", q=q, page=page_no - 1, size=size) if page_no > 1 else None,
+        "next": url_for("search", q=q, page=page_no + 1, size=size) if has_next else None,
+    }
+    return render_template("home.html", books=books, page=page, query=q)
+
+@app.post("/books/add")
+def add_book():
+    book = parse_book(request.form)
+    if book is None:
+        return "Thiếu dữ liệu hợp lệ", 400
+    try:
+        run_write(_tx_add_book, book)
+    except WriteRejected as exc:
+        return str(exc), exc.status
+    return redirect(url_for("home"))
+
+@app.post("/books/import")
+def import_books_route():
+    """Nhận CSV/JSONL qua body thô hoặc multipart field `file`; định dạng lấy từ ?format=,
+    đuôi file hoặc Content-Type."""
+    upload = request.files.get("file")
+    name = upload.filename if upload else ""
+    fmt = request.args.get("format") or _detect_format(name, request.mimetype)
+    if fmt not in IMPORT_FORMATS:
+        return {"error": f"format phải là một trong {', '.join(IMPORT_FORMATS)}"}, 400
+
+    raw = upload.stream if upload else request.stream
+    text_stream = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    stats = import_books(get_db(), read_records(text_stream, fmt))
+    return stats, (400 if "error" in stats else 200)
+
+def _detect_format(filename: str, mimetype: str = ""):
+    name = (filename or "").lower()
+    if name.endswith(".csv") or mimetype == "text/csv":
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson")) or mimetype in ("application/x-ndjson", "application/jsonl"):
+        return "jsonl"
+    return None
+
+@app.post("/books/delete/<int:book_id>")
+def delete_book(book_id: int):
+    try:
+        run_write(_tx_delete_book, book_id)
+    except WriteRejected as exc:
+        return str(exc), exc.status
     return redirect(url_for("home"))
 
 @app.post("/loans/borrow/<int:book_id>")
@@ -166,27 +1245,104 @@ def borrow_book(book_id: int):
     if not borrower:
         return "Thiếu tên người mượn", 400
 
-    db = get_db()
-    if get_current_loan(db, book_id):
-        return "Sách đang có người mượn", 400
-
     now = datetime.now()
     due = now + timedelta(days=14)
-    db.execute(
-        "INSERT INTO loans(book_id, borrower_name, borrowed_at, due_at) VALUES (?,?,?,?)",
-        (book_id, borrower, now.strftime("%Y-%m-%d %H:%M:%S"), due.strftime("%Y-%m-%d")),
-    )
-    db.commit()
+    try:
+        run_write(_tx_borrow_book, book_id, borrower,
+                  now.strftime("%Y-%m-%d %H:%M:%S"), due.strftime("%Y-%m-%d"))
+    except WriteRejected as exc:
+        return str(exc), exc.status
     return redirect(url_for("home"))
 
 @app.post("/loans/return/<int:loan_id>")
 def return_book(loan_id: int):
-    db = get_db()
-    db.execute(
-        "UPDATE loans SET returned_at=? WHERE id=? AND returned_at IS NULL",
-        (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), loan_id),
-    )
-    db.commit()
+    run_write(_tx_return_book, loan_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
     return redirect(url_for("home"))
 
+# ---- BÁO CÁO (JSON, đọc từ bảng tổng hợp) ----
+REPORT_LIMIT = 100
+MAX_REPORT_LIMIT = 1000
+
+def _report_limit():
+    return min(max(_int_arg("limit", REPORT_LIMIT), 1), MAX_REPORT_LIMIT)
+
+@app.get("/reports/overdue")
+def report_overdue():
+    """Loan đang mở đã quá hạn, quá hạn lâu nhất trước (range seek trên idx_loans_overdue)."""
+    today = request.args.get("as_of") or datetime.now().strftime("%Y-%m-%d")
+    rows = get_db().execute("""
+        SELECT l.id AS loan_id, l.book_id, b.title, l.borrower_name, l.borrowed_at, l.due_at,
+               CAST(julianday(?) - julianday(l.due_at) AS INTEGER) AS days_overdue
+        FROM loans l
+        JOIN books b ON b.id = l.book_id
+        WHERE l.returned_at IS NULL AND l.due_at < ?
+        ORDER BY l.due_at, l.id
+        LIMIT ?
+    """, (today, today, _report_limit())).fetchall()
+    return {"as_of": today, "loans": [dict(r) for r in rows]}
+
+@app.get("/reports/borrowers")
+def report_borrowers():
+    """Người mượn theo số loan đang mở giảm dần; ?name= để xem một người."""
+    db = get_db()
+    name = (request.args.get("name") or "").strip()
+    if name:
+        rows = db.execute(
+            "SELECT * FROM borrower_stats WHERE borrower_name = ?", (name,)
+        ).fetchall()
+    else:
+        rows = db.execute("""
+            SELECT * FROM borrower_stats WHERE active_loans > 0
+            ORDER BY active_loans DESC, borrower_name LIMIT ?
+        """, (_report_limit(),)).fetchall()
+    return {"borrowers": [dict(r) for r in rows]}
+
+@app.get("/reports/daily")
+def report_daily():
+    """Số lượt mượn/trả theo ngày trong [from, to] (mặc định 30 ngày gần nhất)."""
+    today = datetime.now()
+    day_to = request.args.get("to") or today.strftime("%Y-%m-%d")
+    day_from = request.args.get("from") or (today - timedelta(days=29)).strftime("%Y-%m-%d")
+    rows = get_db().execute(
+        "SELECT day, borrowed, returned FROM loan_daily WHERE day BETWEEN ? AND ? ORDER BY day",
+        (day_from, day_to),
+    ).fetchall()
+    days = [dict(r) for r in rows]
+    return {
+        "from": day_from,
+        "to": day_to,
+        "days": days,
+        "total": {"borrowed": sum(d["borrowed"] for d in days),
+                  "returned": sum(d["returned"] for d in days)},
+    }
+
+# ---- CLI ----
+@app.cli.command("migrate")
+def migrate_command():
+    """Đưa schema DB lên phiên bản mới nhất (PRAGMA user_version)."""
+    pool = ConnectionPool(DB_PATH, size=1)
+    db = pool.acquire()
+    try:
+        before, after = migrate(db)
+        unique_index = ensure_unique_books_index(db)
+    finally:
+        pool.release(db)
+    click.echo(f"schema v{before} -> v{after}" if before != after else f"schema đã ở v{after}")
+    if not unique_index:
+        click.echo("cảnh báo: books có bản trùng nên chưa tạo idx_books_unique (xem README: Sách trùng)")
 
+@app.cli.command("import-books")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(IMPORT_FORMATS), default=None,
+              help="Mặc định đoán theo đuôi file.")
+@click.option("--batch-size", default=IMPORT_BATCH_SIZE, show_default=True)
+def import_books_command(path, fmt, batch_size):
+    """Nhập sách hàng loạt từ file CSV/JSONL."""
+    fmt = fmt or _detect_format(path)
+    if fmt is None:
+        raise click.UsageError("không đoán được định dạng, dùng --format")
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        stats = import_books(get_db(), read_records(f, fmt), batch_size=batch_size)
+    click.echo(json.dumps(stats, ensure_ascii=False))
+    if "error" in stats:
+        raise SystemExit(1)
@@ -0,0 +1,325 @@
+"""Chạy app WSGI (Flask) trên asyncio: mỗi kết nối là một coroutine, không phải một luồng.
+
+Kết nối keep-alive đang rảnh chỉ tốn một coroutine chờ đọc socket, nên một
+process giữ được hàng nghìn client. Chỉ request đang xử lý mới chiếm luồng:
+handler (kể cả truy vấn SQLite) chạy trong ThreadPoolExecutor cỡ cố định,
+vòng lặp sự kiện chỉ lo đọc/ghi socket và phân tích HTTP/1.1.
+
+    python aserve.py app.py --port 8000
+    python aserve.py library-demos/v4_cacheable/app.py --port 8004 --workers 64
+
+Chỉ dùng thư viện chuẩn; hỗ trợ keep-alive, Content-Length, chunked (cả chiều
+vào lẫn chiều ra cho response stream), Expect: 100-continue.
+"""
+import argparse
+import asyncio
+import contextvars
+import importlib.util
+import io
+import os
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from pathlib import Path
+from urllib.parse import unquote
+
+DEFAULT_WORKERS = int(os.environ.get("ASERVE_WORKERS", "32"))
+KEEPALIVE_TIMEOUT = 75.0
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+
+class BadRequest(Exception):
+    pass
+
+
+class AsyncWSGIServer:
+    def __init__(self, app, host="127.0.0.1", port=8000, workers=DEFAULT_WORKERS,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.keepalive_timeout = keepalive_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="wsgi")
+        self.server_address = None
+        self._connections = {}          # task -> writer của các kết nối đang mở
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._handle, self.host, self.port, limit=MAX_HEADER_BYTES, backlog=4096)
+        self.server_address = self._server.sockets[0].getsockname()[:2]
+        return self
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    @property
+    def connections(self) -> int:
+        return len(self._connections)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        # đóng socket thay vì cancel: handler thấy EOF và thoát bình thường
+        for writer in self._connections.values():
+            writer.transport.abort()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    # ---- một kết nối ----
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keepalive_timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._write_error(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+                    break
+                try:
+                    method, target, version, headers = parse_head(head)
+                    if headers.get("expect", "").lower() == "100-continue":
+                        writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                    body = await read_body(reader, headers)
+                except BadRequest:
+                    await self._write_error(writer, HTTPStatus.BAD_REQUEST)
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                keep_alive = wants_keep_alive(version, headers)
+                environ = self._environ(method, target, version, headers, body, writer)
+                # mọi lần gọi vào app của một request dùng chung một Context: response
+                # stream của Flask giữ app/request context trong contextvars
+                ctx = contextvars.Context()
+                status, out_headers, chunks, more = await loop.run_in_executor(
+                    self.executor, ctx.run, call_app, self.app, environ)
+                await self._write_response(writer, version, status, out_headers, chunks, more,
+                                           keep_alive, method == "HEAD", ctx)
+                if not keep_alive:
+                    break
+        except ConnectionError:     # client đóng kết nối giữa chừng
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    def _environ(self, method, target, version, headers, body, writer):
+        path, _, query = target.partition("?")
+        peer = writer.get_extra_info("peername") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote(path, "latin-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": self.host,
+            "SERVER_PORT": str(self.server_address[1]),
+            "SERVER_PROTOCOL": version,
+            "REMOTE_ADDR": peer[0],
+            "REMOTE_PORT": str(peer[1]),
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.input_terminated": True,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in headers.items():
+            if name == "content-type":
+                environ["CONTENT_TYPE"] = value
+            elif name not in ("content-length", "transfer-encoding"):
+                environ["HTTP_" + name.upper().replace("-", "_")] = value
+        return environ
+
+    async def _write_response(self, writer, version, status, headers, chunks, more, keep_alive, head_only, ctx):
+        names = {k.lower() for k, _ in headers}
+        chunked = more is not None and "content-length" not in names and version == "HTTP/1.1"
+        if more is not None and not chunked and "content-length" not in names:
+            keep_alive = False     # HTTP/1.0 không có chunked: kết thúc body bằng đóng kết nối
+        if more is None and "content-length" not in names and not status.startswith(("1", "204", "304")):
+            headers.append(("Content-Length", str(sum(map(len, chunks)))))
+        if chunked:
+            headers.append(("Transfer-Encoding", "chunked"))
+        headers.append(("Connection", "keep-alive" if keep_alive else "close"))
+
+        lines = [f"HTTP/1.1 {status}"] + [f"{k}: {v}" for k, v in headers]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        loop = asyncio.get_running_loop()
+        try:
+            while not head_only:
+                for chunk in chunks:
+                    if chunk:
+                        writer.write(b"%x\r\n%b\r\n" % (len(chunk), chunk) if chunked else chunk)
+                await writer.drain()
+                if more is None:
+                    break
+                # response stream: kéo từng chunk trong executor, không chặn vòng lặp sự kiện
+                chunks = await loop.run_in_executor(self.executor, ctx.run, more.next_batch)
+                if not chunks:
+                    break
+            if chunked and not head_only:
+                writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            # luôn đóng iterable (kể cả khi client bỏ giữa chừng) để app nhả tài nguyên, vd connection DB
+            if more is not None:
+                await loop.run_in_executor(self.executor, ctx.run, more.close)
+
+    async def _write_error(self, writer, status: HTTPStatus):
+        body = status.phrase.encode("ascii")
+        writer.write(b"HTTP/1.1 %d %b\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%b"
+                     % (status.value, status.phrase.encode("ascii"), len(body), body))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+# ---- HTTP ----
+def parse_head(head: bytes):
+    try:
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise BadRequest(head[:100])
+    if not version.startswith("HTTP/1."):
+        raise BadRequest(version)
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise BadRequest(line)
+        name = name.strip().lower()
+        value = value.strip()
+        headers[name] = f"{headers[name]}, {value}" if name in headers else value
+    return method, target, version, headers
+
+
+async def read_body(reader, headers) -> bytes:
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        parts, total = [], 0
+        while True:
+            size_line = await reader.readuntil(b"\r\n")
+            try:
+                size = int(size_line.split(b";", 1)[0], 16)
+            except ValueError:
+                raise BadRequest(size_line)
+            if size == 0:
+                while (await reader.readuntil(b"\r\n")) != b"\r\n":   # trailer
+                    pass
+                return b"".join(parts)
+            total += size
+            if total > MAX_BODY_BYTES:
+                raise BadRequest("body quá lớn")
+            parts.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise BadRequest(headers["content-length"])
+    if length < 0 or length > MAX_BODY_BYTES:
+        raise BadRequest(length)
+    return await reader.readexactly(length) if length else b""
+
+
+def wants_keep_alive(version, headers) -> bool:
+    connection = headers.get("connection", "").lower()
+    if version == "HTTP/1.0":
+        return "keep-alive" in connection
+    return "close" not in connection
+
+
+# ---- WSGI (chạy trong executor) ----
+class StreamedBody:
+    """Phần còn lại của một response stream; mỗi lần lấy tối đa ~64KB."""
+    BATCH_BYTES = 64 * 1024
+
+    def __init__(self, iterator, iterable):
+        self._iterator = iterator
+        self._iterable = iterable
+
+    def next_batch(self) -> list:
+        batch, size = [], 0
+        for chunk in self._iterator:
+            batch.append(chunk)
+            size += len(chunk)
+            if size >= self.BATCH_BYTES:
+                break
+        return batch
+
+    def close(self):
+        if hasattr(self._iterable, "close"):
+            self._iterable.close()
+
+
+def call_app(app, environ):
+    """(status, headers, chunks, phần còn lại hoặc None). Body có Content-Length được đọc hết."""
+    started = {}
+    written = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and started:
+            raise exc_info[1].with_traceback(exc_info[2])
+        started["status"], started["headers"] = status, list(headers)
+        return written.append
+
+    try:
+        iterable = app(environ, start_response)
+        iterator = iter(iterable)
+        first = next(iterator, None)   # ép start_response với app dạng generator
+        chunks = written + ([first] if first is not None else [])
+        if first is None or any(k.lower() == "content-length" for k, _ in started["headers"]):
+            chunks.extend(iterator)
+            if hasattr(iterable, "close"):
+                iterable.close()
+            return started["status"], started["headers"], chunks, None
+        return started["status"], started["headers"], chunks, StreamedBody(iterator, iterable)
+    except Exception:
+        traceback.print_exc(file=environ["wsgi.errors"])
+        body = b"Internal Server Error"
+        return "500 Internal Server Error", [("Content-Type", "text/plain"),
+                                             ("Content-Length", str(len(body)))], [body], None
+
+
+def load_app(path: Path, attr="app"):
+    path = path.resolve()
+    sys.path.insert(0, str(path.parent))
+    spec = importlib.util.spec_from_file_location(f"aserve_{path.parent.name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, attr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("app", type=Path, help="file Python chứa biến `app` (WSGI)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="số luồng chạy handler")
+    args = parser.parse_args(argv)
+
+    server = AsyncWSGIServer(load_app(args.app), args.host, args.port, args.workers)
+    print(f"Serving {args.app} on http://{args.host}:{args.port} (asyncio, {args.workers} workers)",
+          file=sys.stderr)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
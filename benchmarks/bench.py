@@ -0,0 +1,528 @@
+"""Bộ đo tải cho các service demo.
+
+Mỗi lần chạy: nạp app từ file, seed N sách, chạy server cục bộ (werkzeug
+threaded, hoặc asyncio qua aserve.py) rồi bắn một hỗn hợp thao tác thực tế từ
+C luồng client keep-alive, tuỳ chọn kèm K kết nối keep-alive rảnh giữ suốt lượt đo.
+Kết quả (throughput, p50/p95/p99 theo từng thao tác) ghi ra JSON để so sánh
+giữa các commit.
+
+    python benchmarks/bench.py run --services root,v4 --sizes 1000,100000 \\
+        --concurrency 1,8,32 --duration 10 --out bench.json
+    python benchmarks/bench.py run --services root,v3,v4 --servers threaded,async \\
+        --concurrency 32 --idle-clients 2000
+    python benchmarks/bench.py compare old.json new.json --threshold 10
+"""
+import argparse
+import asyncio
+import http.client
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import secrets
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlencode
+
+from werkzeug.serving import make_server
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+from aserve import AsyncWSGIServer
+
+DEMO_TOKEN = "demo-token"
+SERVERS = ("threaded", "async")
+
+SERVICE_FILES = {
+    "root": ROOT / "app.py",
+    "pagination": ROOT / "pagination" / "app.py",
+    "v1": ROOT / "library-demos" / "v1_client-server" / "app.py",
+    "v2": ROOT / "library-demos" / "v2_uniform-interface" / "app.py",
+    "v3": ROOT / "library-demos" / "v3_stateless" / "app.py",
+    "v4": ROOT / "library-demos" / "v4_cacheable" / "app.py",
+}
+
+
+# ---- Nạp & seed từng service ----
+def load_module(service: str, tag: str):
+    """Nạp app.py như một module mới (state sạch cho mỗi lần chạy)."""
+    path = SERVICE_FILES[service]
+    name = f"bench_{service}_{tag}"
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    # v3/v4 không chạy khi thiếu khoá ký token (ngoài chế độ debug): khoá ngẫu nhiên cho lần đo
+    os.environ.setdefault("DEMO_TOKEN_KEYS", f"bench:{secrets.token_hex(16)}")
+    sys.path.insert(0, str(path.parent))
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(str(path.parent))
+    return module
+
+
+def seed_root(m, n, workdir: Path):
+    m.DB_PATH = workdir / "library.db"
+    with m.app.app_context():
+        db = m.get_db()
+        m.import_books(db, (
+            {"title": f"Book #{i}", "author": f"Author {i % 1000}", "year": 1950 + i % 70}
+            for i in range(1, n + 1)
+        ))
+    return {"db_path": m.DB_PATH}
+
+
+def seed_pagination(m, n, workdir: Path):
+    for b in m.seed_books(n)[len(m.BOOKS_BY_ID):]:
+        m.insert_book(b)
+    m.DB_PATH = workdir / "books.db"
+    db = sqlite3.connect(m.DB_PATH)
+    m.init_db(db)
+    m.seed_db(db, max(n - len(m.BOOKS), 0))
+    db.close()
+    return {}
+
+
+def seed_demo(m, n, workdir: Path):
+    """v1..v4: thay store `books` bằng n sách."""
+    extra = {"updated_at": time.time()} if "updated_at" in next(iter(m.books.values()), {}) else {}
+    m.books = m.ShardedStore("b", start=n + 1)
+    for i in range(1, n + 1):
+        book_id = f"b{i}"
+        m.books.put(book_id, {"id": book_id, "title": f"Book #{i}", "author": f"Author {i % 1000}",
+                              "available": True, **extra})
+        if hasattr(m, "touch_book"):
+            m.touch_book(book_id)
+    return {}
+
+
+SEEDERS = {
+    "root": seed_root,
+    "pagination": seed_pagination,
+    "v1": seed_demo,
+    "v2": seed_demo,
+    "v3": seed_demo,
+    "v4": seed_demo,
+}
+
+
+# ---- Client ----
+class Session:
+    """Một connection HTTP/1.1 keep-alive; ghi độ trễ theo tên thao tác."""
+
+    def __init__(self, host, port, samples: dict, headers=None):
+        self.host, self.port = host, port
+        self.samples = samples
+        self.headers = headers or {}
+        self.conn = None
+
+    def request(self, op, method, path, body=None, headers=None):
+        hdrs = {**self.headers, **(headers or {})}
+        data = None
+        if isinstance(body, dict) and hdrs.get("Content-Type") == "application/x-www-form-urlencoded":
+            data = urlencode(body).encode()
+        elif body is not None:
+            data = json.dumps(body).encode()
+            hdrs.setdefault("Content-Type", "application/json")
+        t0 = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.conn.request(method, path, body=data, headers=hdrs)
+            resp = self.conn.getresponse()
+            payload = resp.read()
+            status, resp_headers = resp.status, resp.headers
+            if resp.getheader("Connection", "").lower() == "close":
+                self.close()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            status, resp_headers, payload = 0, {}, b""
+        elapsed = time.perf_counter() - t0
+        rec = self.samples.setdefault(op, {"latencies": [], "statuses": {}})
+        rec["latencies"].append(elapsed)
+        rec["statuses"][status] = rec["statuses"].get(status, 0) + 1
+        return status, resp_headers, payload
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+# ---- Hỗn hợp thao tác ----
+# Mỗi thao tác: fn(session, rnd, state) ; state là dict riêng của từng luồng client.
+def _json(payload):
+    try:
+        return json.loads(payload)
+    except ValueError:
+        return {}
+
+
+def root_ops(n, ctx):
+    form = {"Content-Type": "application/x-www-form-urlencoded"}
+
+    def list_first(s, rnd, st):
+        s.request("list", "GET", "/")
+
+    def list_page(s, rnd, st):
+        s.request("page", "GET", f"/?after={rnd.randint(0, n)}")
+
+    def search(s, rnd, st):
+        s.request("search", "GET", f"/search?q=Author+{rnd.randint(0, 999)}")
+
+    def borrow_return(s, rnd, st):
+        db = st.setdefault("db", sqlite3.connect(ctx["db_path"]))
+        book_id = rnd.randint(1, n)
+        s.request("borrow", "POST", f"/loans/borrow/{book_id}", {"borrower_name": "bench"}, form)
+        row = db.execute(
+            "SELECT id FROM loans WHERE book_id=? AND returned_at IS NULL", (book_id,)
+        ).fetchone()
+        if row:
+            s.request("return", "POST", f"/loans/return/{row[0]}", {}, form)
+
+    return [(50, list_first), (25, list_page), (15, search), (10, borrow_return)]
+
+
+def pagination_ops(n, ctx):
+    def offset(s, rnd, st):
+        s.request("offset", "GET", f"/api/books.offset?offset={rnd.randint(0, n)}&limit=20")
+
+    def page(s, rnd, st):
+        s.request("page", "GET", f"/api/books.page?page={rnd.randint(1, max(n // 20, 1))}&size=20")
+
+    def cursor_walk(s, rnd, st):
+        cur = st.get("cursor")
+        _, _, body = s.request("cursor", "GET", "/api/books.cursor?limit=20" + (f"&cursor={cur}" if cur else ""))
+        st["cursor"] = _json(body).get("nextCursor")
+
+    def keyset(s, rnd, st):
+        cur = st.get("keyset")
+        _, _, body = s.request("keyset", "GET", "/api/books.keyset?sort=author&limit=20" + (f"&cursor={cur}" if cur else ""))
+        st["keyset"] = _json(body).get("nextCursor")
+
+    def filtered(s, rnd, st):
+        s.request("filtered", "GET", f"/api/books.page?size=20&author=Author+{rnd.randint(1, 20)}")
+
+    return [(25, offset), (20, page), (25, cursor_walk), (20, keyset), (10, filtered)]
+
+
+def v1_ops(n, ctx):
+    def list_books(s, rnd, st):
+        s.request("list", "GET", "/books")
+
+    def borrow_return(s, rnd, st):
+        status, _, body = s.request("borrow", "POST", "/borrow", {"book_id": f"b{rnd.randint(1, n)}", "user": "bench"})
+        if status == 201:
+            s.request("return", "POST", "/return", {"loan_id": _json(body)["id"]})
+
+    return [(80, list_books), (20, borrow_return)]
+
+
+def rest_ops(n, ctx, conditional=False, idempotent=False):
+    """v2/v3/v4: tài nguyên /books, /loans; v4 thêm GET có điều kiện (If-None-Match)."""
+    def get(s, rnd, st, op, path):
+        headers = {}
+        etag = st.get(path) if conditional else None
+        if etag:
+            headers["If-None-Match"] = etag
+        status, resp_headers, _ = s.request(op, "GET", path, headers=headers)
+        if conditional and resp_headers and resp_headers.get("ETag"):
+            st[path] = resp_headers.get("ETag")
+
+    def list_books(s, rnd, st):
+        get(s, rnd, st, "list", "/books")
+
+    def get_book(s, rnd, st):
+        get(s, rnd, st, "get_book", f"/books/b{rnd.randint(1, n)}")
+
+    def borrow_return(s, rnd, st):
+        headers = {"Idempotency-Key": f"bench-{rnd.getrandbits(64):x}"} if idempotent else None
+        status, _, body = s.request("borrow", "POST", "/loans",
+                                    {"book_id": f"b{rnd.randint(1, n)}", "user": "bench"}, headers)
+        if status == 201:
+            loan_id = _json(body)["data"]["id"]
+            s.request("return", "PATCH", f"/loans/{loan_id}", {"returned": True})
+
+    def list_loans(s, rnd, st):
+        s.request("list_loans", "GET", "/loans")
+
+    return [(40, list_books), (35, get_book), (15, borrow_return), (10, list_loans)]
+
+
+MIXES = {
+    "root": root_ops,
+    "pagination": pagination_ops,
+    "v1": v1_ops,
+    "v2": rest_ops,
+    "v3": lambda n, ctx: rest_ops(n, ctx, idempotent=True),
+    "v4": lambda n, ctx: rest_ops(n, ctx, conditional=True, idempotent=True),
+}
+AUTH_SERVICES = {"v3", "v4"}
+
+
+# ---- Chạy một cấu hình ----
+class AsyncServerThread:
+    """AsyncWSGIServer chạy trên event loop ở luồng riêng; cùng giao diện với server werkzeug."""
+
+    def __init__(self, app):
+        self.loop = asyncio.new_event_loop()
+        self.server = AsyncWSGIServer(app, "127.0.0.1", 0)
+        self.loop.run_until_complete(self.server.start())
+        self.server_address = self.server.server_address
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        asyncio.run_coroutine_threadsafe(self.server.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def server_close(self):
+        self.loop.close()
+
+
+def serve(app, mode="threaded"):
+    if mode == "async":
+        return AsyncServerThread(app)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)   # không log từng request
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def open_idle_clients(host, port, n):
+    """n kết nối keep-alive đã gửi một request rồi nằm im (như client chờ thao tác tiếp)."""
+    socks = []
+    for _ in range(n):
+        s = socket.create_connection((host, port))
+        s.sendall(f"GET /health HTTP/1.1\r\nHost: {host}\r\n\r\n".encode("ascii"))
+        socks.append(s)
+    return socks
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = max(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(k, len(sorted_values) - 1)]
+
+
+def summarize(samples: dict, seconds: float) -> dict:
+    def stats(latencies, statuses):
+        lat = sorted(latencies)
+        ms = lambda v: round(v * 1000, 3) if v is not None else None
+        errors = sum(c for st, c in statuses.items() if st == 0 or st >= 500)
+        return {
+            "count": len(lat),
+            "errors": errors,
+            "throughput_rps": round(len(lat) / seconds, 1),
+            "mean_ms": ms(sum(lat) / len(lat)) if lat else None,
+            "p50_ms": ms(percentile(lat, 50)),
+            "p95_ms": ms(percentile(lat, 95)),
+            "p99_ms": ms(percentile(lat, 99)),
+            "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        }
+
+    ops = {op: stats(rec["latencies"], rec["statuses"]) for op, rec in sorted(samples.items())}
+    all_lat = [v for rec in samples.values() for v in rec["latencies"]]
+    all_status = {}
+    for rec in samples.values():
+        for st, c in rec["statuses"].items():
+            all_status[st] = all_status.get(st, 0) + c
+    return {"overall": stats(all_lat, all_status), "ops": ops}
+
+
+def run_load(host, port, mix, concurrency, duration, warmup, headers, seed):
+    """C luồng, mỗi luồng một keep-alive connection, chạy tới hết thời gian."""
+    weights = [w for w, _ in mix]
+    fns = [f for _, f in mix]
+    per_thread = [dict() for _ in range(concurrency)]
+    start_barrier = threading.Barrier(concurrency + 1)
+    timing = {}
+
+    def worker(idx):
+        rnd = random.Random(seed + idx)
+        state = {}
+        warm = Session(host, port, {}, headers)
+        session = Session(host, port, per_thread[idx], headers)
+        start_barrier.wait()
+        warm_until = timing["start"] + warmup
+        while time.perf_counter() < warm_until:
+            rnd.choices(fns, weights)[0](warm, rnd, state)
+        warm.close()
+        while time.perf_counter() < timing["end"]:
+            rnd.choices(fns, weights)[0](session, rnd, state)
+        session.close()
+        if "db" in state:
+            state["db"].close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    timing["start"] = time.perf_counter()
+    timing["end"] = timing["start"] + warmup + duration
+    start_barrier.wait()
+    for t in threads:
+        t.join()
+
+    merged = {}
+    for samples in per_thread:
+        for op, rec in samples.items():
+            m = merged.setdefault(op, {"latencies": [], "statuses": {}})
+            m["latencies"].extend(rec["latencies"])
+            for st, c in rec["statuses"].items():
+                m["statuses"][st] = m["statuses"].get(st, 0) + c
+    return merged
+
+
+def bench_service(service, size, concurrencies, duration, warmup, seed, mode="threaded", idle_clients=0):
+    results = []
+    with tempfile.TemporaryDirectory(prefix=f"bench-{service}-") as tmp:
+        module = load_module(service, f"{size}")
+        t0 = time.perf_counter()
+        ctx = SEEDERS[service](module, size, Path(tmp))
+        seed_seconds = time.perf_counter() - t0
+        server = serve(module.app, mode)
+        host, port = server.server_address[:2]
+        headers = {}
+        if service in AUTH_SERVICES:
+            # token ký HMAC nếu app hỗ trợ (đo cả chi phí xác thực), ngược lại token cố định
+            tokens = getattr(module, "tokens", None)
+            token = tokens.issue("bench", ttl=24 * 3600) if tokens else DEMO_TOKEN
+            headers = {"Authorization": f"Bearer {token}"}
+        idle = []
+        try:
+            idle = open_idle_clients(host, port, idle_clients)
+            for c in concurrencies:
+                print(f"  {service} [{mode}] size={size} concurrency={c} idle={idle_clients} ...",
+                      file=sys.stderr, flush=True)
+                mix = MIXES[service](size, ctx)
+                samples = run_load(host, port, mix, c, duration, warmup, headers, seed)
+                results.append({
+                    "service": service,
+                    "server": mode,
+                    "idle_clients": idle_clients,
+                    "size": size,
+                    "concurrency": c,
+                    "duration_s": duration,
+                    "seed_s": round(seed_seconds, 3),
+                    **summarize(samples, duration),
+                })
+        finally:
+            for s in idle:
+                s.close()
+            server.shutdown()
+            server.server_close()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---- So sánh hai lần chạy ----
+def compare(old: dict, new: dict, threshold: float) -> list:
+    """Các cấu hình mà throughput giảm hoặc p95 tăng quá threshold (%)."""
+    key = lambda r: (r["service"], r.get("server", "threaded"), r.get("idle_clients", 0),
+                     r["size"], r["concurrency"])
+    before = {key(r): r for r in old["results"]}
+    rows = []
+    for r in new["results"]:
+        o = before.get(key(r))
+        if o is None:
+            continue
+        thr_old, thr_new = o["overall"]["throughput_rps"], r["overall"]["throughput_rps"]
+        p95_old, p95_new = o["overall"]["p95_ms"], r["overall"]["p95_ms"]
+        d_thr = (thr_new - thr_old) / thr_old * 100 if thr_old else 0.0
+        d_p95 = (p95_new - p95_old) / p95_old * 100 if p95_old and p95_new is not None else 0.0
+        rows.append({
+            "service": r["service"], "server": r.get("server", "threaded"),
+            "size": r["size"], "concurrency": r["concurrency"],
+            "throughput_rps": [thr_old, thr_new], "throughput_change_pct": round(d_thr, 1),
+            "p95_ms": [p95_old, p95_new], "p95_change_pct": round(d_p95, 1),
+            "regression": d_thr < -threshold or d_p95 > threshold,
+        })
+    return rows
+
+
+def _int_list(text):
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    run = sub.add_parser("run", help="chạy benchmark")
+    run.add_argument("--services", default=",".join(SERVICE_FILES),
+                     help=f"danh sách, mặc định: {','.join(SERVICE_FILES)}")
+    run.add_argument("--sizes", type=_int_list, default=[1000], help="vd 1000,100000,1000000")
+    run.add_argument("--concurrency", type=_int_list, default=[1, 8, 32])
+    run.add_argument("--servers", default="threaded", help=f"danh sách trong: {','.join(SERVERS)}")
+    run.add_argument("--idle-clients", type=int, default=0,
+                     help="số kết nối keep-alive rảnh mở thêm trong lúc đo")
+    run.add_argument("--duration", type=float, default=10.0, help="giây đo cho mỗi cấu hình")
+    run.add_argument("--warmup", type=float, default=1.0)
+    run.add_argument("--seed", type=int, default=1234)
+    run.add_argument("--out", type=Path, help="file JSON kết quả (mặc định stdout)")
+
+    cmp_ = sub.add_parser("compare", help="so sánh hai file kết quả")
+    cmp_.add_argument("old", type=Path)
+    cmp_.add_argument("new", type=Path)
+    cmp_.add_argument("--threshold", type=float, default=10.0, help="%% thay đổi coi là hồi quy")
+
+    args = parser.parse_args(argv)
+    if args.cmd == "compare":
+        rows = compare(json.loads(args.old.read_text()), json.loads(args.new.read_text()), args.threshold)
+        print(json.dumps(rows, indent=2))
+        return 1 if any(r["regression"] for r in rows) else 0
+
+    services = [s.strip() for s in args.services.split(",") if s.strip()]
+    unknown = set(services) - set(SERVICE_FILES)
+    if unknown:
+        parser.error(f"service không tồn tại: {', '.join(sorted(unknown))}")
+    servers = [s.strip() for s in args.servers.split(",") if s.strip()]
+    if set(servers) - set(SERVERS):
+        parser.error(f"--servers chỉ nhận: {', '.join(SERVERS)}")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+        },
+        "results": [],
+    }
+    for service in services:
+        for mode in servers:
+            for size in args.sizes:
+                report["results"].extend(bench_service(
+                    service, size, args.concurrency, args.duration, args.warmup, args.seed,
+                    mode, args.idle_clients))
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        args.out.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Đo tranh chấp khoá của ShardedStore (library-demos/common/store.py).
+
+So sánh store chia N shard với store 1 shard (tương đương một khoá toàn cục)
+khi nhiều luồng cùng mượn/trả (compare_and_set) trên các sách ngẫu nhiên.
+Kết quả là JSON: ops/giây và hệ số tăng so với 1 luồng.
+
+    python benchmarks/store_contention.py --threads 1,2,4,8,16 --duration 3
+
+Lưu ý: trên CPython có GIL, chỉ một luồng chạy bytecode tại một thời điểm nên
+cả hai cấu hình đều khó tăng tuyến tính; khác biệt do khoá thể hiện rõ nhất
+trên bản free-threaded (python3.13t trở lên).
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "library-demos"))
+from common.store import DEFAULT_SHARDS, ShardedStore
+
+
+def make_store(shards, n_books):
+    store = ShardedStore("b", shards=shards)
+    for i in range(1, n_books + 1):
+        store.put(f"b{i}", {"id": f"b{i}", "available": True})
+    return store
+
+
+def run(store, n_books, threads, duration, seed):
+    counts = [0] * threads
+    barrier = threading.Barrier(threads + 1)
+    stop = [False]
+
+    def worker(idx):
+        rnd = random.Random(seed + idx)
+        ops = 0
+        barrier.wait()
+        while not stop[0]:
+            key = f"b{rnd.randint(1, n_books)}"
+            if store.compare_and_set(key, "available", True, False) is not None:
+                store.new_id()
+                store.compare_and_set(key, "available", False, True)
+            ops += 1
+        counts[idx] = ops
+
+    ts = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in ts:
+        t.start()
+    barrier.wait()
+    t0 = time.perf_counter()
+    time.sleep(duration)
+    stop[0] = True
+    for t in ts:
+        t.join()
+    return sum(counts) / (time.perf_counter() - t0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", default="1,2,4,8,16")
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS)
+    parser.add_argument("--books", type=int, default=10_000)
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args(argv)
+    thread_counts = [int(x) for x in args.threads.split(",") if x.strip()]
+
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    report = {
+        "meta": {"python": platform.python_version(), "gil_enabled": gil,
+                 "books": args.books, "duration_s": args.duration},
+        "results": [],
+    }
+    for label, shards in (("global_lock", 1), (f"sharded_{args.shards}", args.shards)):
+        base = None
+        for threads in thread_counts:
+            store = make_store(shards, args.books)
+            ops = run(store, args.books, threads, args.duration, args.seed)
+            base = base or ops
+            report["results"].append({
+                "store": label,
+                "threads": threads,
+                "ops_per_sec": round(ops),
+                "speedup_vs_1_thread": round(ops / base, 2),
+            })
+            print(f"  {label:>12} threads={threads:<3} {ops:>12,.0f} ops/s", file=sys.stderr, flush=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
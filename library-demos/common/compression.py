@@ -0,0 +1,118 @@
+"""Nén response theo Accept-Encoding: zstd (nếu có thư viện), gzip, deflate.
+
+Chỉ nén body từ MIN_SIZE byte trở lên và có kiểu nội dung dạng văn bản/JSON.
+Biểu diễn đã nén có ETag riêng (hậu tố "-<encoding>" trong dấu nháy) để cache
+trung gian không lẫn các biến thể; strip_etag_encoding() trả về ETag gốc khi so
+If-None-Match.
+"""
+import gzip
+import zlib
+
+from flask import request
+
+try:                                    # Python 3.14+
+    from compression import zstd as _zstd
+    _zstd_compress = lambda data: _zstd.compress(data, level=3)
+except ImportError:
+    try:
+        import zstandard as _zstd
+        _zstd_compress = _zstd.ZstdCompressor(level=3).compress
+    except ImportError:
+        _zstd_compress = None
+
+MIN_SIZE = 1024
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+_COMPRESSORS = {
+    "gzip": lambda data: gzip.compress(data, compresslevel=6, mtime=0),
+    "deflate": lambda data: zlib.compress(data, 6),
+}
+if _zstd_compress is not None:
+    _COMPRESSORS["zstd"] = _zstd_compress
+
+# thứ tự ưu tiên của server khi client chấp nhận nhiều loại với cùng q
+PREFERENCE = tuple(e for e in ("zstd", "gzip", "deflate") if e in _COMPRESSORS)
+
+
+def negotiate(accept_encoding: str):
+    """Encoding tốt nhất mà client chấp nhận (q > 0), hoặc None (gửi nguyên bản)."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    star = weights.get("*", 0.0)
+    best, best_q = None, 0.0
+    for enc in PREFERENCE:
+        q = weights.get(enc, star)
+        if q > best_q:
+            best, best_q = enc, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    return _COMPRESSORS[encoding](body)
+
+
+def compressible(resp) -> bool:
+    return (resp.status_code == 200
+            and "Content-Encoding" not in resp.headers
+            and not resp.is_streamed
+            and (resp.mimetype or "").startswith(COMPRESSIBLE_TYPES)
+            and (resp.content_length or 0) >= MIN_SIZE)
+
+
+def encoded_etag(etag, encoding):
+    if not etag or not encoding:
+        return etag
+    return f'{etag[:-1]}-{encoding}"' if etag.endswith('"') else f"{etag}-{encoding}"
+
+
+def strip_etag_encoding(etag):
+    if etag:
+        for enc in PREFERENCE:
+            for suffix in (f'-{enc}"', f"-{enc}"):
+                if etag.endswith(suffix):
+                    return etag[:-len(suffix)] + ('"' if suffix.endswith('"') else "")
+    return etag
+
+
+def add_vary(resp):
+    vary = resp.headers.get("Vary")
+    if not vary:
+        resp.headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        resp.headers["Vary"] = f"{vary}, Accept-Encoding"
+
+
+def apply(resp, encoding, body=None):
+    """Gắn body đã nén (tính mới nếu không truyền) + header tương ứng vào resp."""
+    resp.set_data(body if body is not None else compress(resp.get_data(), encoding))
+    resp.headers["Content-Encoding"] = encoding
+    if "ETag" in resp.headers:
+        resp.headers["ETag"] = encoded_etag(resp.headers["ETag"], encoding)
+    add_vary(resp)
+    return resp
+
+
+def init_app(app):
+    """Nén mọi response đủ lớn ở after_request (response đã nén sẵn từ cache được bỏ qua)."""
+    @app.after_request
+    def _compress_response(resp):
+        if (resp.mimetype or "").startswith(COMPRESSIBLE_TYPES):
+            add_vary(resp)
+        if compressible(resp):
+            encoding = negotiate(request.headers.get("Accept-Encoding", ""))
+            if encoding:
+                apply(resp, encoding)
+        return resp
+
+    return app
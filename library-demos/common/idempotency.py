@@ -0,0 +1,204 @@
+"""Kho Idempotency-Key dùng chung cho các demo v3/v4.
+
+- Hết hạn theo TTL, giới hạn số entry và tổng byte (LRU).
+- Tuỳ chọn lưu xuống SQLite để giữ kết quả qua lần khởi động lại.
+- Gộp request trùng đang chạy: request thứ hai cùng key chờ request đầu
+  xong rồi phát lại kết quả, không thực thi lại.
+
+Gắn vào app Flask bằng ``init_app(app, store)``; route ghi gọi
+``maybe_replay_idempotent()`` ở đầu và ``store_idempotent(resp)`` trước khi trả.
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, jsonify, request
+
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_ENTRIES = 10_000
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+DEFAULT_WAIT = 10.0
+PURGE_INTERVAL = 60.0        # giây giữa hai lần xoá dòng hết hạn trong SQLite
+REPLAY_HEADERS = ("Content-Type", "Location")
+
+
+class InFlightTimeout(Exception):
+    """Request trước cùng key vẫn chưa xong sau thời gian chờ."""
+
+
+class IdempotencyStore:
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, db_path=None, wait_timeout=DEFAULT_WAIT):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.wait_timeout = wait_timeout
+        self._entries = OrderedDict()   # key -> record
+        self._inflight = {}             # key -> threading.Event
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._next_purge = 0.0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS idempotency(
+                    key TEXT PRIMARY KEY,
+                    status INTEGER NOT NULL,
+                    headers TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    expires REAL NOT NULL
+                )
+            """)
+            self._purge_expired(time.time())
+
+    # ---- API ----
+    def begin(self, key):
+        """Kết quả đã lưu của `key` (dict status/headers/body) để phát lại, hoặc None
+        nếu caller được quyền thực thi — khi đó phải gọi complete() hoặc release()."""
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            with self._lock:
+                record = self._get(key)
+                if record is not None:
+                    return record
+                event = self._inflight.get(key)
+                if event is None:
+                    self._inflight[key] = threading.Event()
+                    return None
+            # request khác đang xử lý cùng key → chờ nó xong rồi xem lại
+            if not event.wait(max(deadline - time.monotonic(), 0)):
+                raise InFlightTimeout(key)
+
+    def complete(self, key, status, headers, body: bytes):
+        """Lưu kết quả và đánh thức các request đang chờ cùng key."""
+        record = {"status": status, "headers": dict(headers), "body": body,
+                  "expires": time.time() + self.ttl}
+        with self._lock:
+            self._put(key, record)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO idempotency(key, status, headers, body, expires) VALUES (?,?,?,?,?)",
+                    (key, status, json.dumps(record["headers"]), body, record["expires"]),
+                )
+                self._db.commit()
+                # LRU chỉ bỏ entry khỏi bộ nhớ; dòng trong SQLite được dọn khi hết hạn
+                now = time.time()
+                if now >= self._next_purge:
+                    self._purge_expired(now)
+            self._wake(key)
+
+    def release(self, key):
+        """Bỏ quyền thực thi mà không lưu (vd request lỗi) → request chờ sẽ tự chạy lại."""
+        with self._lock:
+            self._wake(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "in_flight": len(self._inflight),
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "persistent": self._db is not None,
+            }
+
+    # ---- nội bộ (gọi khi đang giữ self._lock) ----
+    def _purge_expired(self, now):
+        self._db.execute("DELETE FROM idempotency WHERE expires < ?", (now,))
+        self._db.commit()
+        self._next_purge = now + PURGE_INTERVAL
+
+    def _get(self, key):
+        record = self._entries.get(key)
+        if record is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT status, headers, body, expires FROM idempotency WHERE key=?", (key,)
+            ).fetchone()
+            if row is not None:
+                record = {"status": row[0], "headers": json.loads(row[1]),
+                          "body": row[2], "expires": row[3]}
+                self._put(key, record)
+        if record is None:
+            return None
+        if record["expires"] <= time.time():
+            self._drop(key)
+            if self._db is not None:
+                self._db.execute("DELETE FROM idempotency WHERE key=?", (key,))
+                self._db.commit()
+            return None
+        self._entries.move_to_end(key)
+        return record
+
+    def _put(self, key, record):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = record
+        self._bytes += self._size(record)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        record = self._entries.pop(key, None)
+        if record is not None:
+            self._bytes -= self._size(record)
+
+    def _wake(self, key):
+        event = self._inflight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    @staticmethod
+    def _size(record) -> int:
+        return len(record["body"]) + sum(len(k) + len(v) for k, v in record["headers"].items())
+
+
+# ---- Flask ----
+def init_app(app, store):
+    """Dùng `store` cho app; request giữ key mà không lưu kết quả được nhả ở teardown."""
+    app.extensions["idempotency"] = store
+
+    @app.teardown_request
+    def _release_idempotency(exc=None):
+        # request giữ key nhưng không lưu kết quả (lỗi 4xx/exception) → nhả cho request chờ
+        key = g.pop("idemp_key", None)
+        if key:
+            store.release(key)
+
+    return app
+
+
+def _idempotency_key():
+    key = request.headers.get("Idempotency-Key")
+    if not key:
+        return None
+    # phạm vi theo client + method + path: cùng key từ client khác không đụng nhau
+    return "|".join((g.get("principal") or "", request.method, request.path, key))
+
+
+def maybe_replay_idempotent():
+    """Response phát lại nếu key đã có kết quả, None nếu request này được thực thi."""
+    key = _idempotency_key()
+    if key is None:
+        return None
+    store = current_app.extensions["idempotency"]
+    try:
+        cached = store.begin(key)   # request trùng đang chạy → chờ kết quả của nó
+    except InFlightTimeout:
+        return jsonify({"error": "Request cùng Idempotency-Key đang được xử lý"}), 409
+    if cached is None:
+        g.idemp_key = key
+        return None
+    return current_app.response_class(cached["body"], status=cached["status"], headers=cached["headers"])
+
+
+def store_idempotent(resp):
+    key = g.pop("idemp_key", None)
+    if key:
+        headers = {h: resp.headers[h] for h in REPLAY_HEADERS if h in resp.headers}
+        current_app.extensions["idempotency"].complete(key, resp.status_code, headers, resp.get_data())
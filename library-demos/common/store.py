@@ -0,0 +1,179 @@
+"""Kho dữ liệu trong bộ nhớ, an toàn đa luồng, chia shard.
+
+Mỗi shard có khoá riêng nên các thao tác trên key khác shard không chặn nhau.
+Bản ghi là bất biến theo quy ước: mọi thay đổi tạo dict mới (copy-on-write),
+nên get()/values() trả thẳng tham chiếu mà không cần copy hay giữ khoá khi
+serialize. Cấp id dùng itertools.count (next() là nguyên tử), không cần khoá.
+
+Ngoài các shard còn một chỉ mục toàn cục theo thứ tự chèn (key -> bản ghi), cập
+nhật ngay trong khoá shard khi ghi, để values() chỉ là một lượt duyệt tuyến tính.
+
+Trong khối ``with journal() as j:`` mọi thao tác ghi của luồng hiện tại (trên
+mọi store) được ghi lại; ``j.rollback()`` hoàn tác chúng theo thứ tự ngược.
+"""
+import itertools
+import threading
+from contextlib import contextmanager
+
+DEFAULT_SHARDS = 16
+
+_local = threading.local()
+
+
+class Journal:
+    """Nhật ký hoàn tác: (store, key, entry trước, bản ghi sau) cho mỗi lần ghi."""
+
+    def __init__(self):
+        self.entries = []
+
+    def rollback(self, since=0) -> list:
+        """Hoàn tác (theo thứ tự ngược) các lần ghi từ vị trí `since`; trả các key không
+        hoàn tác được vì đã bị request khác sửa tiếp (không ghi đè thay đổi của người khác)."""
+        conflicts = []
+        while len(self.entries) > since:
+            store, key, before, after = self.entries.pop()
+            if not store._restore(key, before, after):
+                conflicts.append(key)
+        return conflicts
+
+
+@contextmanager
+def journal():
+    previous = getattr(_local, "journal", None)
+    _local.journal = j = Journal()
+    try:
+        yield j
+    finally:
+        _local.journal = previous
+
+
+class ShardedStore:
+    def __init__(self, prefix, items=None, shards=DEFAULT_SHARDS, start=None):
+        self.prefix = prefix
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+        self._seq = itertools.count()       # thứ tự chèn, để liệt kê ổn định
+        self._order = {}                    # key -> item theo thứ tự chèn, cho values()
+        self._order_lock = threading.Lock() # luôn lấy SAU khoá shard
+        for key, item in (items or {}).items():
+            self.put(key, item)
+        self._ids = itertools.count(start if start is not None else len(self) + 1)
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def new_id(self) -> str:
+        return f"{self.prefix}{next(self._ids)}"
+
+    # ---- đọc ----
+    def get(self, key):
+        entry = self._shard(key)[0].get(key)
+        return entry[1] if entry is not None else None
+
+    def __contains__(self, key):
+        return key in self._shard(key)[0]
+
+    def __len__(self):
+        return len(self._order)
+
+    def values(self) -> list:
+        """Mọi bản ghi theo thứ tự chèn (một lượt duyệt chỉ mục toàn cục)."""
+        with self._order_lock:
+            return list(self._order.values())
+
+    # ---- ghi ----
+    def put(self, key, item: dict):
+        data, lock = self._shard(key)
+        with lock:
+            entry = data.get(key)
+            self._set(data, key, (entry[0] if entry else next(self._seq), item))
+            self._record(key, entry, item)
+        return item
+
+    def update(self, key, fields: dict):
+        """Gộp `fields` vào bản ghi; trả bản mới, hoặc None nếu không có key."""
+        data, lock = self._shard(key)
+        with lock:
+            entry = data.get(key)
+            if entry is None:
+                return None
+            item = {**entry[1], **fields}
+            self._set(data, key, (entry[0], item))
+            self._record(key, entry, item)
+            return item
+
+    def compare_and_set(self, key, field, expected, new, **also):
+        """Nguyên tử: nếu item[field] == expected thì đặt = new (cùng các field `also`).
+
+        Trả bản mới nếu thành công, None nếu giá trị hiện tại khác expected;
+        KeyError nếu không có key.
+        """
+        data, lock = self._shard(key)
+        with lock:
+            entry = data.get(key)
+            if entry is None:
+                raise KeyError(key)
+            if entry[1].get(field) != expected:
+                return None
+            item = {**entry[1], field: new, **also}
+            self._set(data, key, (entry[0], item))
+            self._record(key, entry, item)
+            return item
+
+    def pop_if(self, key, field, expected):
+        """Nguyên tử: xoá và trả bản ghi nếu item[field] == expected, ngược lại None;
+        KeyError nếu không có key."""
+        data, lock = self._shard(key)
+        with lock:
+            entry = data.get(key)
+            if entry is None:
+                raise KeyError(key)
+            if entry[1].get(field) != expected:
+                return None
+            self._delete(data, key)
+            self._record(key, entry, None)
+            return entry[1]
+
+    # Hai hàm dưới chạy khi đang giữ khoá shard của key: shard và chỉ mục luôn khớp nhau.
+    def _set(self, data, key, entry):
+        data[key] = entry
+        with self._order_lock:
+            self._order[key] = entry[1]     # key đã có: giữ nguyên vị trí
+
+    def _delete(self, data, key):
+        # bỏ khỏi chỉ mục trước: mọi key trong _order luôn còn trong shard (xem _restore)
+        with self._order_lock:
+            del self._order[key]
+        del data[key]
+
+    # ---- nhật ký ----
+    def _record(self, key, before, after):
+        j = getattr(_local, "journal", None)
+        if j is not None:
+            j.entries.append((self, key, before, after))
+
+    def _restore(self, key, before, after) -> bool:
+        """Đưa key về `before` nếu giá trị hiện tại vẫn đúng là `after` (so sánh đồng nhất)."""
+        data, lock = self._shard(key)
+        with lock:
+            entry = data.get(key)
+            if (entry[1] if entry is not None else None) is not after:
+                return False
+            if before is None:
+                self._delete(data, key)
+            elif entry is None:
+                # khôi phục bản ghi đã xoá: đưa về đúng vị trí chèn cũ trong chỉ mục
+                data[key] = before
+                with self._order_lock:
+                    self._order[key] = before[1]
+                    ordered = sorted(self._order, key=lambda k: self._shard(k)[0][k][0])
+                    self._order = {k: self._order[k] for k in ordered}
+            else:
+                self._set(data, key, before)
+            return True
+
+    def clear(self):
+        for data, lock in self._shards:
+            with lock:
+                data.clear()
+        with self._order_lock:
+            self._order.clear()
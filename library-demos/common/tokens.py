@@ -0,0 +1,153 @@
+"""Token ký HMAC cho các demo v3/v4: không trạng thái, có hạn dùng, xoay khoá.
+
+Dạng token: ``v1.<payload>.<chữ ký>`` (base64url, không padding), payload là
+JSON ``{"kid", "sub", "iat", "exp"}``, chữ ký = HMAC-SHA256(khoá[kid], "v1.<payload>").
+
+Server chỉ cần bộ khoá để xác thực, không tra cứu phiên nên scale ngang tự do.
+Khoá đầu tiên trong danh sách dùng để ký; các khoá còn lại vẫn được chấp nhận
+khi xác thực (xoay khoá: thêm khoá mới lên đầu, bỏ khoá cũ khi token cũ hết hạn).
+Kết quả xác thực được nhớ trong LRU có giới hạn, nên lần gặp lại cùng token
+chỉ tốn một lần tra dict + so sánh hạn dùng.
+
+Khoá lấy từ biến môi trường; thiếu biến thì chỉ chế độ debug mới chạy, bằng khoá
+dev công khai (DEV_KEYS). Token cố định cũ (LEGACY_TOKEN) chỉ được nhận khi bật
+rõ ràng bằng DEMO_ALLOW_LEGACY_TOKEN=1.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+
+VERSION = "v1"
+DEFAULT_TTL = 3600
+DEFAULT_CACHE_SIZE = 4096
+DEV_KEYS = "dev:dev-secret-change-me"      # nằm trong repo: ai cũng ký được, chỉ dùng khi debug
+LEGACY_TOKEN = "demo-token"                 # token cố định cũ, principal "demo"
+
+log = logging.getLogger(__name__)
+
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def parse_keys(spec: str) -> dict:
+    """"kid1:secret1,kid2:secret2" -> {kid: secret bytes}, giữ thứ tự (khoá đầu dùng để ký)."""
+    keys = {}
+    for part in spec.split(","):
+        kid, sep, secret = part.strip().partition(":")
+        if not sep or not kid or not secret:
+            raise ValueError(f"khoá không hợp lệ: {part!r} (cần dạng kid:secret)")
+        keys[kid] = secret.encode("utf-8")
+    if not keys:
+        raise ValueError("cần ít nhất một khoá")
+    return keys
+
+
+class TokenAuthority:
+    def __init__(self, keys: dict, cache_size=DEFAULT_CACHE_SIZE):
+        self._keys = dict(keys)
+        self.active_kid = next(iter(self._keys))
+        self.cache_size = cache_size
+        self._cache = OrderedDict()     # token -> claims
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    @classmethod
+    def from_env(cls, var="DEMO_TOKEN_KEYS", debug=False):
+        """Bộ khoá từ biến `var`. Thiếu biến: debug thì dùng DEV_KEYS kèm cảnh báo,
+        ngược lại RuntimeError (không âm thầm ký bằng khoá công khai)."""
+        spec = os.environ.get(var)
+        if not spec:
+            if not debug:
+                raise RuntimeError(f"chưa đặt {var} (dạng kid:secret[,kid:secret...])")
+            log.warning("%s chưa đặt: dùng khoá dev công khai, chỉ dành cho môi trường dev", var)
+            spec = DEV_KEYS
+        return cls(parse_keys(spec))
+
+    def _sign(self, kid, signing_input: bytes) -> bytes:
+        return hmac.new(self._keys[kid], signing_input, hashlib.sha256).digest()
+
+    def issue(self, subject: str, ttl=DEFAULT_TTL) -> str:
+        now = int(time.time())
+        claims = {"kid": self.active_kid, "sub": subject, "iat": now, "exp": now + int(ttl)}
+        payload = _b64(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        signing_input = f"{VERSION}.{payload}".encode("ascii")
+        return f"{VERSION}.{payload}.{_b64(self._sign(self.active_kid, signing_input))}"
+
+    def verify(self, token: str):
+        """Claims nếu token hợp lệ và còn hạn, ngược lại None."""
+        now = time.time()
+        with self._lock:
+            claims = self._cache.get(token)
+            if claims is not None:
+                self._cache.move_to_end(token)
+                self.hits += 1
+        if claims is not None:
+            # khoá có thể đã bị gỡ sau khi token được nhớ
+            return claims if claims["exp"] > now and claims["kid"] in self._keys else None
+
+        claims = self._verify_uncached(token, now)
+        with self._lock:
+            self.misses += 1
+            if claims is not None:
+                self._cache[token] = claims
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return claims
+
+    def _verify_uncached(self, token, now):
+        try:
+            version, payload, signature = token.split(".")
+            if version != VERSION:
+                return None
+            claims = json.loads(_unb64(payload))
+            kid = claims["kid"]
+            if kid not in self._keys:
+                return None
+            expected = self._sign(kid, f"{version}.{payload}".encode("ascii"))
+            if not hmac.compare_digest(expected, _unb64(signature)):
+                return None
+            if not isinstance(claims.get("sub"), str) or claims["exp"] <= now:
+                return None
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+        return claims
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "active_kid": self.active_kid,
+                "kids": list(self._keys),
+                "cache_entries": len(self._cache),
+                "cache_size": self.cache_size,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def legacy_token_enabled(var="DEMO_ALLOW_LEGACY_TOKEN") -> bool:
+    return os.environ.get(var, "").strip().lower() in ("1", "true", "yes")
+
+
+def bearer_principal(authority, allow_legacy=False):
+    """Principal của header `Authorization: Bearer <token>` hợp lệ, hoặc None.
+    Không tra cứu phiên phía server."""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme != "Bearer" or not token:
+        return None
+    if allow_legacy and hmac.compare_digest(token, LEGACY_TOKEN):
+        return "demo"
+    claims = authority.verify(token)
+    return claims["sub"] if claims else None
@@ -0,0 +1,83 @@
+"""POST /batch của v2: atomic=true phải hoàn tác mọi thao tác trước đó khi có lỗi."""
+import importlib.util
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+DEMOS = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(DEMOS))
+
+
+@pytest.fixture
+def v2():
+    # nạp lại module mỗi test: store nằm ở cấp module
+    spec = importlib.util.spec_from_file_location("v2_app", DEMOS / "v2_uniform-interface" / "app.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def borrow_then(op):
+    return {"atomic": True, "operations": [
+        {"method": "POST", "path": "/loans", "body": {"book_id": "b1", "user": "u"}},
+        op,
+    ]}
+
+
+@pytest.fixture
+def crashing_create(v2, monkeypatch):
+    # handler ghi dở rồi ném lỗi: phần ghi dở cũng phải được hoàn tác
+    def boom():
+        v2.books.put("half", {"id": "half"})
+        raise RuntimeError("boom")
+    monkeypatch.setitem(v2.app.view_functions, "create_book", boom)
+
+
+CREATE = {"method": "POST", "path": "/books", "body": {"title": "t", "author": "a"}}
+
+
+def assert_untouched(v2):
+    assert len(v2.loans) == 0
+    assert v2.books.get("b1")["available"] is True
+
+
+def test_atomic_rolls_back_on_error_status(v2):
+    resp = v2.app.test_client().post("/batch", json=borrow_then(
+        {"method": "GET", "path": "/books/missing"}))
+    assert resp.status_code == 409
+    doc = resp.get_json()
+    assert doc["failed_index"] == 1
+    assert doc["data"][0]["rolled_back"] is True
+    assert_untouched(v2)
+
+
+def test_atomic_rolls_back_when_handler_raises(v2, crashing_create):
+    resp = v2.app.test_client().post("/batch", json=borrow_then(CREATE))
+    assert resp.status_code == 409
+    assert resp.get_json()["data"][1]["status"] == 500
+    assert_untouched(v2)
+    assert "half" not in v2.books
+
+
+def test_non_atomic_keeps_successful_operations(v2, crashing_create):
+    resp = v2.app.test_client().post("/batch", json={**borrow_then(CREATE), "atomic": False})
+    assert resp.status_code == 200
+    assert [r["status"] for r in resp.get_json()["data"]] == [201, 500]
+    assert v2.books.get("b1")["available"] is False
+    assert "half" not in v2.books
+
+
+@pytest.mark.parametrize("payload", ["x", 5, True, None])
+def test_scalar_payload_is_rejected(v2, payload):
+    resp = v2.app.test_client().post("/batch", data=json.dumps(payload), content_type="application/json")
+    assert resp.status_code == 400
+
+
+def test_non_object_body_is_a_400_result(v2):
+    resp = v2.app.test_client().post("/batch", json=borrow_then(
+        {"method": "POST", "path": "/books", "body": "oops"}))
+    assert resp.status_code == 409
+    assert resp.get_json()["data"][1]["status"] == 400
+    assert_untouched(v2)
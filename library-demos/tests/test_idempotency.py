@@ -0,0 +1,66 @@
+"""IdempotencyStore + phần gắn vào Flask (common/idempotency.py)."""
+import sqlite3
+import sys
+from pathlib import Path
+
+from flask import Flask, jsonify
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common import idempotency
+from common.idempotency import IdempotencyStore, maybe_replay_idempotent, store_idempotent
+
+
+def make_app(store):
+    app = Flask(__name__)
+    idempotency.init_app(app, store)
+    calls = []
+
+    @app.post("/things")
+    def create():
+        replay = maybe_replay_idempotent()
+        if replay: return replay
+        calls.append(1)
+        resp = jsonify({"n": len(calls)})
+        resp.status_code = 201
+        store_idempotent(resp)
+        return resp
+
+    @app.post("/fail")
+    def fail():
+        replay = maybe_replay_idempotent()
+        if replay: return replay
+        return jsonify({"error": "bad"}), 400
+
+    return app, calls
+
+
+def test_same_key_replays_without_running_again():
+    app, calls = make_app(IdempotencyStore())
+    c = app.test_client()
+    first = c.post("/things", headers={"Idempotency-Key": "k"})
+    again = c.post("/things", headers={"Idempotency-Key": "k"})
+    assert (first.status_code, again.status_code) == (201, 201)
+    assert again.get_json() == first.get_json() and len(calls) == 1
+    c.post("/things", headers={"Idempotency-Key": "other"})
+    assert len(calls) == 2
+
+
+def test_failed_request_releases_key():
+    store = IdempotencyStore(wait_timeout=0.1)
+    app, _ = make_app(store)
+    c = app.test_client()
+    assert c.post("/fail", headers={"Idempotency-Key": "k"}).status_code == 400
+    assert store.stats()["in_flight"] == 0
+
+
+def test_complete_purges_expired_rows(tmp_path, monkeypatch):
+    db_path = tmp_path / "idem.db"
+    store = IdempotencyStore(db_path=db_path, max_entries=1, ttl=-1)
+    # entry đã hết hạn và bị LRU đẩy khỏi bộ nhớ: chỉ còn trong SQLite
+    store.complete("a", 201, {}, b"x")
+    store.complete("b", 201, {}, b"y")
+    store.ttl = 60
+    monkeypatch.setattr(store, "_next_purge", 0.0)
+    store.complete("c", 201, {}, b"z")
+    keys = [k for (k,) in sqlite3.connect(db_path).execute("SELECT key FROM idempotency")]
+    assert keys == ["c"]
@@ -0,0 +1,29 @@
+"""ShardedStore: values() theo thứ tự chèn, kể cả sau cập nhật, xoá và hoàn tác."""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.store import ShardedStore, journal
+
+
+def ids(store):
+    return [item["id"] for item in store.values()]
+
+
+def test_values_keep_insertion_order():
+    store = ShardedStore("b", {f"b{i}": {"id": f"b{i}"} for i in range(50)})
+    store.update("b3", {"title": "x"})
+    store.compare_and_set("b7", "id", "b7", "b7", available=False)
+    assert ids(store) == [f"b{i}" for i in range(50)]
+    assert store.pop_if("b10", "id", "b10")["id"] == "b10"
+    assert "b10" not in ids(store) and len(store) == 49
+
+
+def test_rollback_restores_deleted_item_in_place():
+    store = ShardedStore("b", {f"b{i}": {"id": f"b{i}"} for i in range(20)})
+    with journal() as j:
+        store.pop_if("b5", "id", "b5")
+        store.put("b99", {"id": "b99"})
+        j.rollback()
+    assert ids(store) == [f"b{i}" for i in range(20)]
+    assert store.get("b5") == {"id": "b5"}
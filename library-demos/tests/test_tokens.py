@@ -0,0 +1,40 @@
+"""Khoá ký token và token cố định cũ (common/tokens.py)."""
+import sys
+from pathlib import Path
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.tokens import DEV_KEYS, LEGACY_TOKEN, TokenAuthority, bearer_principal, legacy_token_enabled
+
+
+def test_missing_keys_fail_outside_debug(monkeypatch):
+    monkeypatch.delenv("DEMO_TOKEN_KEYS", raising=False)
+    with pytest.raises(RuntimeError):
+        TokenAuthority.from_env()
+
+
+def test_debug_falls_back_to_dev_keys_with_warning(monkeypatch, caplog):
+    monkeypatch.delenv("DEMO_TOKEN_KEYS", raising=False)
+    tokens = TokenAuthority.from_env(debug=True)
+    assert "DEMO_TOKEN_KEYS" in caplog.text
+    assert tokens.active_kid == DEV_KEYS.partition(":")[0]
+
+
+def principal(tokens, header, allow_legacy):
+    app = Flask(__name__)
+    with app.test_request_context(headers={"Authorization": header}):
+        return bearer_principal(tokens, allow_legacy)
+
+
+def test_legacy_token_needs_opt_in(monkeypatch):
+    monkeypatch.setenv("DEMO_TOKEN_KEYS", "k1:secret")
+    tokens = TokenAuthority.from_env()
+    assert principal(tokens, f"Bearer {LEGACY_TOKEN}", False) is None
+    assert principal(tokens, f"Bearer {LEGACY_TOKEN}", True) == "demo"
+    assert principal(tokens, f"Bearer {tokens.issue('alice')}", False) == "alice"
+    monkeypatch.delenv("DEMO_ALLOW_LEGACY_TOKEN", raising=False)
+    assert legacy_token_enabled() is False
+    monkeypatch.setenv("DEMO_ALLOW_LEGACY_TOKEN", "1")
+    assert legacy_token_enabled() is True
@@ -1,107 +1,231 @@
+import sys
+from pathlib import Path
 from flask import Flask, request, jsonify, url_for, make_response
+from werkzeug.exceptions import BadRequest, HTTPException
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common import compression
+from common.store import ShardedStore, journal
 
 app = Flask(__name__)
+compression.init_app(app)
 
-books = {
+books = ShardedStore("b", {
     "b1": {"id": "b1", "title": "Lập trình Python cơ bản", "author": "A. Nguyen", "available": True},
     "b2": {"id": "b2", "title": "Kiến trúc REST", "author": "B. Tran", "available": True},
-}
-loans = {}
-_next_book = 3
-_next_loan = 1
+})
+loans = ShardedStore("l")
 
 def wrap(data, links=None):
     doc = {"data": data}
     if links: doc["links"] = links
     return doc
 
+# ---- ?fields= (chỉ trả các field cần) và ?include=book (nhúng sách vào loan) ----
+BOOK_FIELDS = ("id", "title", "author", "available")
+LOAN_FIELDS = ("id", "book_id", "user", "returned")
+LOAN_INCLUDES = ("book",)
+
+class InvalidQuery(BadRequest):
+    """Giá trị ?fields= / ?include= không được hỗ trợ."""
+
+@app.errorhandler(InvalidQuery)
+def invalid_query(e):
+    return jsonify({"error": e.description}), 400
+
+def query_list(name, allowed):
+    """?name=a,b -> tuple theo thứ tự, bỏ trùng; None nếu không truyền."""
+    raw = request.args.get(name)
+    if raw is None:
+        return None
+    values = tuple(dict.fromkeys(v.strip() for v in raw.split(",") if v.strip()))
+    unknown = [v for v in values if v not in allowed]
+    if unknown:
+        raise InvalidQuery(f"'{name}' không hỗ trợ: {', '.join(unknown)} (chọn trong {', '.join(allowed)})")
+    return values
+
+def project(item, fields):
+    return item if fields is None else {k: item[k] for k in fields if k in item}
+
+def url_template(endpoint, arg):
+    """Gọi url_for MỘT lần với giá trị giữ chỗ; trả hàm id -> URL dùng cho từng dòng."""
+    prefix, _, suffix = url_for(endpoint, **{arg: "__id__"}).partition("__id__")
+    return lambda value: f"{prefix}{value}{suffix}"
+
+def embed_book(loan, book_url):
+    b = books.get(loan["book_id"])
+    return {**b, "links": {"self": book_url(b["id"])}} if b else None
+
 @app.get("/books")
 def get_books():
-    items = []
-    for b in books.values():
-        items.append({**b, "links": {"self": url_for("get_book", book_id=b["id"], _external=False)}})
+    fields = query_list("fields", BOOK_FIELDS)
+    book_url = url_template("get_book", "book_id")
+    items = [{**project(b, fields), "links": {"self": book_url(b["id"])}} for b in books.values()]
     return jsonify(wrap(items, links={"self": url_for("get_books")})), 200
 
 @app.post("/books")
 def create_book():
-    global _next_book
     payload = request.get_json(force=True, silent=True) or {}
     title = payload.get("title"); author = payload.get("author")
     if not title or not author:
         return jsonify({"error": "Thiếu 'title'/'author'"}), 400
-    book_id = f"b{_next_book}"; _next_book += 1
-    books[book_id] = {"id": book_id, "title": title, "author": author, "available": True}
+    book_id = books.new_id()
+    book = books.put(book_id, {"id": book_id, "title": title, "author": author, "available": True})
     location = url_for("get_book", book_id=book_id)
-    resp = make_response(jsonify(wrap(books[book_id], links={"self": location})), 201)
+    resp = make_response(jsonify(wrap(book, links={"self": location})), 201)
     resp.headers["Location"] = location
     return resp
 
 @app.get("/books/<book_id>")
 def get_book(book_id):
+    fields = query_list("fields", BOOK_FIELDS)
     b = books.get(book_id)
     if not b:
         return jsonify({"error": "Không tìm thấy sách"}), 404
-    return jsonify(wrap(b, links={"self": url_for("get_book", book_id=book_id)})), 200
+    return jsonify(wrap(project(b, fields), links={"self": url_for("get_book", book_id=book_id)})), 200
 
 @app.patch("/books/<book_id>")
 @app.put("/books/<book_id>")
 def update_book(book_id):
-    b = books.get(book_id)
+    payload = request.get_json(force=True, silent=True) or {}
+    b = books.update(book_id, {k: payload[k] for k in ("title","author","available") if k in payload})
     if not b:
         return jsonify({"error": "Không tìm thấy sách"}), 404
-    payload = request.get_json(force=True, silent=True) or {}
-    for k in ("title","author","available"):
-        if k in payload: b[k] = payload[k]
     return jsonify(wrap(b, links={"self": url_for("get_book", book_id=book_id)})), 200
 
 @app.delete("/books/<book_id>")
 def delete_book(book_id):
-    if book_id not in books:
+    try:
+        removed = books.pop_if(book_id, "available", True)
+    except KeyError:
         return jsonify({"error": "Không tìm thấy sách"}), 404
-    if not books[book_id]["available"]:
+    if removed is None:
         return jsonify({"error": "Không thể xoá: sách đang được mượn"}), 409
-    del books[book_id]
     return "", 204
 
 @app.get("/loans")
 def list_loans():
+    fields = query_list("fields", LOAN_FIELDS)
+    include = query_list("include", LOAN_INCLUDES) or ()
+    loan_url = url_template("get_loan", "loan_id")
+    book_url = url_template("get_book", "book_id")
     items = []
     for l in loans.values():
-        items.append({**l, "links": {"self": url_for("get_loan", loan_id=l["id"])}})
+        item = {**project(l, fields), "links": {"self": loan_url(l["id"])}}
+        if "book" in include:
+            item["book"] = embed_book(l, book_url)
+        items.append(item)
     return jsonify(wrap(items, links={"self": url_for("list_loans")})), 200
 
 @app.post("/loans")
 def create_loan():
-    global _next_loan
     payload = request.get_json(force=True, silent=True) or {}
     book_id = payload.get("book_id"); user = payload.get("user")
     if not book_id or not user: return jsonify({"error":"Thiếu 'book_id'/'user'"}), 400
-    b = books.get(book_id)
-    if not b: return jsonify({"error":"Không tìm thấy sách"}), 404
-    if not b["available"]: return jsonify({"error":"Sách đang được mượn"}), 409
-    b["available"] = False
-    loan_id = f"l{_next_loan}"; _next_loan += 1
-    loans[loan_id] = {"id": loan_id, "book_id": book_id, "user": user, "returned": False}
+    try:
+        b = books.compare_and_set(book_id, "available", True, False)
+    except KeyError:
+        return jsonify({"error":"Không tìm thấy sách"}), 404
+    if not b: return jsonify({"error":"Sách đang được mượn"}), 409
+    loan_id = loans.new_id()
+    loan = loans.put(loan_id, {"id": loan_id, "book_id": book_id, "user": user, "returned": False})
     location = url_for("get_loan", loan_id=loan_id)
-    resp = make_response(jsonify(wrap(loans[loan_id], links={"self": location})), 201)
+    resp = make_response(jsonify(wrap(loan, links={"self": location})), 201)
     resp.headers["Location"] = location
     return resp
 
 @app.get("/loans/<loan_id>")
 def get_loan(loan_id):
+    fields = query_list("fields", LOAN_FIELDS)
+    include = query_list("include", LOAN_INCLUDES) or ()
     l = loans.get(loan_id)
     if not l: return jsonify({"error":"Không tìm thấy"}), 404
-    return jsonify(wrap(l, links={"self": url_for("get_loan", loan_id=loan_id)})), 200
+    data = project(l, fields)
+    if "book" in include:
+        data = {**data, "book": embed_book(l, url_template("get_book", "book_id"))}
+    return jsonify(wrap(data, links={"self": url_for("get_loan", loan_id=loan_id)})), 200
 
 @app.patch("/loans/<loan_id>")
 def return_loan(loan_id):
-    l = loans.get(loan_id)
-    if not l: return jsonify({"error":"Không tìm thấy"}), 404
-    if l["returned"]:
+    try:
+        returned = loans.compare_and_set(loan_id, "returned", False, True)
+    except KeyError:
+        return jsonify({"error":"Không tìm thấy"}), 404
+    if returned is None:   # đã trả trước đó
+        l = loans.get(loan_id)
         return jsonify(wrap(l, links={"self": url_for("get_loan", loan_id=loan_id)})), 200
-    l["returned"] = True
-    books[l["book_id"]]["available"] = True
+    l = returned
+    books.update(l["book_id"], {"available": True})
     return jsonify(wrap(l, links={"self": url_for("get_loan", loan_id=loan_id)})), 200
 
+# ---- Batch: nhiều thao tác trong một request ----
+MAX_BATCH = 1000
+BATCH_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE"}
+
+def run_operation(op):
+    """Chạy một thao tác con qua chính handler của route (cùng validate); trả kết quả dạng dict."""
+    method = str(op.get("method", "")).upper()
+    path = op.get("path")
+    if method not in BATCH_METHODS or not isinstance(path, str) or not path.startswith("/"):
+        return {"status": 400, "body": {"error": "Cần 'method' hợp lệ và 'path' bắt đầu bằng '/'"}}
+    if path.split("?", 1)[0].rstrip("/") == "/batch":
+        return {"status": 400, "body": {"error": "Không lồng /batch"}}
+    body = op.get("body")
+    if body is not None and not isinstance(body, dict):
+        return {"status": 400, "body": {"error": "'body' phải là object"}}
+    with app.test_request_context(path, method=method, json=body):
+        try:
+            resp = app.make_response(app.dispatch_request())
+        except HTTPException as e:   # 404/405 khi match route
+            return {"status": e.code, "body": {"error": e.description}}
+        except Exception:            # lỗi trong handler: báo như một kết quả 500, batch vẫn chạy tiếp
+            app.logger.exception("batch: %s %s lỗi", method, path)
+            return {"status": 500, "body": {"error": "Lỗi máy chủ"}}
+    result = {"status": resp.status_code, "body": resp.get_json(silent=True)}
+    if "Location" in resp.headers:
+        result["location"] = resp.headers["Location"]
+    return result
+
+@app.post("/batch")
+def batch():
+    """{"atomic": bool, "operations": [{"method", "path", "body"}, ...]} → trạng thái từng thao tác.
+
+    atomic=true: dừng ở thao tác lỗi đầu tiên và hoàn tác mọi thao tác trước đó.
+    """
+    payload = request.get_json(force=True, silent=True)
+    if isinstance(payload, list):
+        payload = {"operations": payload}
+    if not isinstance(payload, dict):
+        return jsonify({"error": "Cần 'operations' là mảng các object"}), 400
+    ops = payload.get("operations")
+    if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+        return jsonify({"error": "Cần 'operations' là mảng các object"}), 400
+    if len(ops) > MAX_BATCH:
+        return jsonify({"error": f"Tối đa {MAX_BATCH} thao tác mỗi batch"}), 413
+    atomic = bool(payload.get("atomic"))
+
+    results = []
+    with journal() as j:
+        try:
+            for i, op in enumerate(ops):
+                mark = len(j.entries)
+                result = run_operation(op)
+                results.append(result)
+                if result["status"] >= 500 and not atomic:
+                    j.rollback(since=mark)      # bỏ phần ghi dở của chính thao tác lỗi
+                if atomic and result["status"] >= 400:
+                    conflicts = j.rollback()
+                    for done in results[:-1]:
+                        done["rolled_back"] = True
+                    doc = {"error": "Batch bị huỷ, đã hoàn tác", "failed_index": i, "data": results}
+                    if conflicts:
+                        doc["rollback_conflicts"] = conflicts
+                    return jsonify(doc), 409
+        except BaseException:
+            if atomic:
+                j.rollback()
+            raise
+    return jsonify(wrap(results, links={"self": url_for("batch")})), 200
+
 if __name__ == "__main__":
     app.run(debug=True)
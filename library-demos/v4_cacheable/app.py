@@ -1,27 +1,255 @@
-import hashlib, json, time
-from flask import Flask, request, jsonify, url_for, make_response
+import os, sys, threading, time, uuid
+import click
+from collections import OrderedDict, deque
+from functools import wraps
+from pathlib import Path
+from flask import Flask, request, jsonify, url_for, make_response, g
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common import compression, idempotency
+from common.idempotency import IdempotencyStore, maybe_replay_idempotent, store_idempotent
+from common.store import ShardedStore
+from common.tokens import TokenAuthority, bearer_principal, legacy_token_enabled
 
 app = Flask(__name__)
-DEMO_TOKEN = "demo-token"
+compression.init_app(app)
+# Token ký HMAC theo từng client: DEMO_TOKEN_KEYS="kid2:secret2,kid1:secret1"
+# (khoá đầu dùng để ký, các khoá sau vẫn xác thực được → xoay khoá không gián đoạn).
+# Không đặt biến thì chỉ chạy được ở chế độ debug (khoá dev công khai).
+tokens = TokenAuthority.from_env(debug=app.debug or __name__ == "__main__")
+# token cố định cũ "demo-token": chỉ nhận khi DEMO_ALLOW_LEGACY_TOKEN=1
+ALLOW_LEGACY_TOKEN = legacy_token_enabled()
 
-books = {
+books = ShardedStore("b", {
     "b1": {"id": "b1", "title": "Lập trình Python cơ bản", "author": "A. Nguyen", "available": True, "updated_at": time.time()},
     "b2": {"id": "b2", "title": "Kiến trúc REST", "author": "B. Tran", "available": True, "updated_at": time.time()},
-}
-loans = {}
-_next_book = 3
-_next_loan = 1
-idemp_store = {}
+})
+loans = ShardedStore("l")
+# Lưu kết quả thao tác theo Idempotency-Key (chống tạo trùng): có TTL, giới hạn bộ nhớ,
+# gộp request trùng đang chạy. Đặt IDEMPOTENCY_DB=<file> để lưu xuống SQLite.
+idemp_store = IdempotencyStore(db_path=os.environ.get("IDEMPOTENCY_DB"))
+idempotency.init_app(app, idemp_store)
+
+# ----- Cache response phía server -----
+# Lưu body đã serialize theo (route, args, principal). TTL lấy từ chính max-age
+# mà route đặt trong Cache-Control; ghi vào books/loans xoá đúng các entry liên quan.
+# Bản nén (gzip/deflate/zstd) được tạo lần đầu có client xin và giữ cùng entry.
+RESPONSE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+class ResponseCache:
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> entry dict
+        self._by_tag = {}               # tag -> set(key)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.generation = 0             # tăng mỗi lần invalidate
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["expires"] <= time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, resp, ttl, tags, generation):
+        """Entry vừa lưu, hoặc None nếu không cache được."""
+        body = resp.get_data()
+        with self._lock:
+            # có ghi xen giữa lúc build response → bỏ, tránh cache dữ liệu cũ
+            if generation != self.generation or len(body) > self.max_bytes:
+                return None
+            if key in self._entries:
+                self._drop(key)
+            entry = self._entries[key] = {
+                "body": body,
+                "encoded": {},          # encoding -> bytes đã nén
+                "status": resp.status_code,
+                "headers": [(k, v) for k, v in resp.headers.items() if k != "Content-Length"],
+                "etag": resp.headers.get("ETag"),
+                "expires": time.monotonic() + ttl,
+                "tags": tags,
+            }
+            self._bytes += len(body)
+            for tag in tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            self._evict()
+            return entry
+
+    def encoded(self, key, entry, encoding) -> bytes:
+        """Body của entry nén bằng `encoding`: nén một lần rồi giữ lại cùng entry."""
+        body = entry["encoded"].get(encoding)
+        if body is None:
+            body = compression.compress(entry["body"], encoding)   # ngoài khoá
+            with self._lock:
+                if self._entries.get(key) is entry and encoding not in entry["encoded"]:
+                    entry["encoded"][encoding] = body
+                    self._bytes += len(body)
+                    self._evict()
+        return body
+
+    def _evict(self):
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, *tags):
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in self._by_tag.pop(tag, ()):
+                    if key in self._entries:
+                        self._drop(key)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry["body"]) + sum(map(len, entry["encoded"].values()))
+        for tag in entry["tags"]:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+response_cache = ResponseCache()
+
+def response_from_cache(key, entry):
+    """Response 200 từ entry, dùng bản nén đã lưu nếu client chấp nhận."""
+    resp = app.response_class(entry["body"], status=entry["status"], headers=entry["headers"])
+    if compression.compressible(resp):
+        encoding = compression.negotiate(request.headers.get("Accept-Encoding", ""))
+        if encoding:
+            compression.apply(resp, encoding, response_cache.encoded(key, entry, encoding))
+    return resp
+
+def cached_response(*tag_templates):
+    """Decorator cho GET: phục vụ từ response_cache; tag dạng "book:{book_id}" lấy từ view args."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**view_args):
+            key = (request.path, tuple(sorted(request.args.items(multi=True))),
+                   g.get("principal") or "")
+            entry = response_cache.get(key)
+            if entry is not None:
+                if entry["etag"] and conditional_etag_match(entry["etag"]):
+                    resp = make_response("", 304)
+                    resp.headers.extend((k, v) for k, v in entry["headers"] if k in ("Cache-Control", "ETag"))
+                else:
+                    resp = response_from_cache(key, entry)
+                resp.headers["X-Cache"] = "HIT"
+                return resp
+
+            generation = response_cache.generation
+            resp = make_response(view(**view_args))
+            ttl = resp.cache_control.max_age
+            if resp.status_code == 200 and ttl:
+                tags = [t.format(**view_args) for t in tag_templates]
+                entry = response_cache.put(key, resp, ttl, tags, generation)
+                if entry is not None:
+                    resp = response_from_cache(key, entry)
+            resp.headers["X-Cache"] = "MISS"
+            return resp
+        return wrapper
+    return decorator
+
+# Phiên bản tăng dần, cập nhật ngay khi ghi → ETag là O(1), không cần hash dữ liệu.
+# _BOOT đổi mỗi lần khởi động để ETag của lần chạy trước không khớp nhầm.
+_BOOT = uuid.uuid4().hex[:8]
+collection_version = 0
+book_versions = {}  # book_id -> collection_version tại lần sửa cuối
+_version_lock = threading.Lock()
+
+# Nhật ký thay đổi dạng vòng: mỗi phiên bản đúng một entry (version, op, book_id).
+# Client gửi ?since=<version> để chỉ nhận phần thay đổi; quá cũ thì đồng bộ lại toàn bộ.
+CHANGE_LOG_SIZE = 10_000
+change_log = deque(maxlen=CHANGE_LOG_SIZE)
+
+def touch_book(book_id, op="updated"):
+    """Gọi sau mỗi thay đổi của một sách; op: created / updated / deleted."""
+    global collection_version
+    with _version_lock:
+        collection_version += 1
+        if op == "deleted":
+            book_versions.pop(book_id, None)
+        else:
+            book_versions[book_id] = collection_version
+        change_log.append((collection_version, op, book_id))
+    response_cache.invalidate("books", f"book:{book_id}")
 
-def auth_required():
-    auth = request.headers.get("Authorization","")
-    return auth == f"Bearer {DEMO_TOKEN}"
+def touch_loan(loan_id):
+    """Gọi sau mỗi thay đổi của một loan (tạo/trả)."""
+    response_cache.invalidate("loans", f"loan:{loan_id}")
+
+def books_etag() -> str:
+    return f"{_BOOT}-{collection_version}"
+
+def book_etag(book_id) -> str:
+    return f"{_BOOT}-{book_id}-{book_versions.get(book_id, 0)}"
+
+def parse_version(token):
+    """Token dạng "<boot>-<version>" (chính là ETag collection) -> int, hoặc None nếu
+    không hợp lệ / thuộc lần chạy khác."""
+    boot, _, version = (token or "").rpartition("-")
+    if boot != _BOOT or not version.isdigit():
+        return None
+    return int(version)
+
+def changes_since(since: int):
+    """{"created", "updated", "deleted"} kể từ phiên bản `since`, hoặc None nếu
+    nhật ký không còn đủ (cần đồng bộ lại toàn bộ)."""
+    with _version_lock:
+        current = collection_version
+        if since > current:
+            return None
+        oldest = change_log[0][0] if change_log else current + 1
+        if since < oldest - 1:
+            return None
+        first_op, last_op = {}, {}
+        # duyệt ngược tới since: entry mới nhất nằm cuối deque
+        for version, op, book_id in reversed(change_log):
+            if version <= since:
+                break
+            first_op[book_id] = op
+            last_op.setdefault(book_id, op)
+    delta = {"created": [], "updated": [], "deleted": []}
+    for book_id, first in first_op.items():
+        last = last_op[book_id]
+        book = books.get(book_id)
+        if last == "deleted" or book is None:
+            if first != "created":   # tạo rồi xoá trong khoảng này: client chưa từng thấy
+                delta["deleted"].append(book_id)
+        else:
+            delta["created" if first == "created" else "updated"].append(book)
+    return delta
+
+for _book in books.values():
+    touch_book(_book["id"], "created")
 
 @app.before_request
 def _auth():
     if request.path.startswith("/health"):
         return
-    if not auth_required():
+    g.principal = bearer_principal(tokens, ALLOW_LEGACY_TOKEN)
+    if g.principal is None:
         return jsonify({"error":"Unauthorized"}), 401
 
 def wrap(data, links=None):
@@ -29,52 +257,45 @@ def wrap(data, links=None):
     if links: doc["links"] = links
     return doc
 
-def etag_for(obj) -> str:
-    # Tạo ETag ổn định từ dữ liệu
-    blob = json.dumps(obj, sort_keys=True, ensure_ascii=False).encode("utf-8")
-    return hashlib.sha256(blob).hexdigest()
-
 def set_cache_headers(resp, max_age=30, etag=None):
     resp.headers["Cache-Control"] = f"public, max-age={max_age}"
     if etag: resp.headers["ETag"] = etag
 
 def conditional_etag_match(etag: str) -> bool:
     inm = request.headers.get("If-None-Match")
-    return inm is not None and inm == etag
-
-def maybe_replay_idempotent():
-    key = request.headers.get("Idempotency-Key")
-    if key and key in idemp_store:
-        cached = idemp_store[key]
-        r = make_response(jsonify(cached["body"]), cached["status"])
-        for h, v in cached["headers"].items():
-            r.headers[h] = v
-        return r
-    return None
-
-def store_idempotent(resp):
-    key = request.headers.get("Idempotency-Key")
-    if key:
-        idemp_store[key] = {
-            "status": resp.status_code,
-            "headers": {k: v for k, v in resp.headers.items()},
-            "body": resp.get_json()
-        }
+    # client có thể gửi lại ETag của bản nén ("...-gzip"): cùng dữ liệu
+    return inm is not None and compression.strip_etag_encoding(inm) == etag
 
 @app.get("/health")
 def health():
     return {"status":"ok"}, 200
 
+@app.get("/cache/stats")
+def cache_stats():
+    return jsonify(response_cache.stats()), 200
+
 @app.get("/books")
+@cached_response("books")
 def get_books():
-    # ETag cho collection dựa trên danh sách sách (id, title, author, available, updated_at)
-    listing = list(books.values())
-    et = etag_for(listing)
+    # ETag cho collection = phiên bản hiện tại → kiểm tra 304 không chạm tới dữ liệu
+    et = books_etag()
     if conditional_etag_match(et):
         resp = make_response("", 304)
         set_cache_headers(resp, max_age=30, etag=et)
         return resp
-    payload = wrap(listing, links={"self": url_for("get_books")})
+    since = request.args.get("since")
+    if since is not None:
+        version = parse_version(since)
+        delta = changes_since(version) if version is not None else None
+        if delta is not None:
+            payload = wrap(delta, links={"self": url_for("get_books", since=since)})
+            payload.update({"version": et, "resync": False})
+            resp = make_response(jsonify(payload), 200)
+            set_cache_headers(resp, max_age=30, etag=et)
+            return resp
+    # không có since, hoặc since quá cũ → trả toàn bộ (client thay thế dữ liệu của mình)
+    payload = wrap(books.values(), links={"self": url_for("get_books")})
+    payload.update({"version": et, "resync": since is not None})
     resp = make_response(jsonify(payload), 200)
     set_cache_headers(resp, max_age=30, etag=et)
     return resp
@@ -83,25 +304,26 @@ def get_books():
 def create_book():
     replay = maybe_replay_idempotent()
     if replay: return replay
-    global _next_book
     data = request.get_json(force=True, silent=True) or {}
     title = data.get("title"); author = data.get("author")
     if not title or not author:
         return jsonify({"error":"Thiếu 'title'/'author'"}), 400
-    book_id = f"b{_next_book}"; _next_book += 1
-    books[book_id] = {"id": book_id, "title": title, "author": author, "available": True, "updated_at": time.time()}
+    book_id = books.new_id()
+    book = books.put(book_id, {"id": book_id, "title": title, "author": author, "available": True, "updated_at": time.time()})
+    touch_book(book_id, "created")
     loc = url_for("get_book", book_id=book_id)
-    resp = make_response(jsonify(wrap(books[book_id], links={"self": loc})), 201)
+    resp = make_response(jsonify(wrap(book, links={"self": loc})), 201)
     resp.headers["Location"] = loc
     store_idempotent(resp)
     return resp
 
 @app.get("/books/<book_id>")
+@cached_response("book:{book_id}")
 def get_book(book_id):
     b = books.get(book_id)
     if not b:
         return jsonify({"error":"Không tìm thấy sách"}), 404
-    et = etag_for(b)
+    et = book_etag(book_id)
     if conditional_etag_match(et):
         resp = make_response("", 304)
         set_cache_headers(resp, max_age=60, etag=et)
@@ -112,19 +334,30 @@ def get_book(book_id):
 
 @app.patch("/books/<book_id>")
 def update_book(book_id):
-    b = books.get(book_id)
+    data = request.get_json(force=True, silent=True) or {}
+    fields = {k: data[k] for k in ("title","author","available") if k in data}
+    b = books.update(book_id, {**fields, "updated_at": time.time()})
     if not b:
         return jsonify({"error":"Không tìm thấy sách"}), 404
-    data = request.get_json(force=True, silent=True) or {}
-    for k in ("title","author","available"):
-        if k in data: b[k] = data[k]
-    b["updated_at"] = time.time()
+    touch_book(book_id)
     # Khi sửa, ETag thay đổi → client GET lần sau sẽ thấy mới
     return jsonify(wrap(b, links={"self": url_for("get_book", book_id=book_id)})), 200
 
+@app.delete("/books/<book_id>")
+def delete_book(book_id):
+    try:
+        removed = books.pop_if(book_id, "available", True)
+    except KeyError:
+        return jsonify({"error":"Không tìm thấy sách"}), 404
+    if removed is None:
+        return jsonify({"error":"Không thể xoá: sách đang được mượn"}), 409
+    touch_book(book_id, "deleted")
+    return "", 204
+
 @app.get("/loans")
+@cached_response("loans")
 def list_loans():
-    resp = make_response(jsonify(wrap(list(loans.values()), links={"self": url_for("list_loans")})), 200)
+    resp = make_response(jsonify(wrap(loans.values(), links={"self": url_for("list_loans")})), 200)
     set_cache_headers(resp, max_age=10)  # loans thường thay đổi nhanh → cache ngắn
     return resp
 
@@ -132,23 +365,27 @@ def list_loans():
 def create_loan():
     replay = maybe_replay_idempotent()
     if replay: return replay
-    global _next_loan
     data = request.get_json(force=True, silent=True) or {}
     book_id = data.get("book_id"); user = data.get("user")
     if not book_id or not user: return jsonify({"error":"Thiếu 'book_id'/'user'"}), 400
-    b = books.get(book_id)
-    if not b: return jsonify({"error":"Không tìm thấy sách"}), 404
-    if not b["available"]: return jsonify({"error":"Sách đang được mượn"}), 409
-    b["available"] = False; b["updated_at"] = time.time()
-    loan_id = f"l{_next_loan}"; _next_loan += 1
-    loans[loan_id] = {"id": loan_id, "book_id": book_id, "user": user, "returned": False}
+    try:
+        # kiểm tra + đánh dấu đã mượn trong một bước nguyên tử
+        b = books.compare_and_set(book_id, "available", True, False, updated_at=time.time())
+    except KeyError:
+        return jsonify({"error":"Không tìm thấy sách"}), 404
+    if not b: return jsonify({"error":"Sách đang được mượn"}), 409
+    touch_book(book_id)
+    loan_id = loans.new_id()
+    loan = loans.put(loan_id, {"id": loan_id, "book_id": book_id, "user": user, "returned": False})
+    touch_loan(loan_id)
     loc = url_for("get_loan", loan_id=loan_id)
-    resp = make_response(jsonify(wrap(loans[loan_id], links={"self": loc})), 201)
+    resp = make_response(jsonify(wrap(loan, links={"self": loc})), 201)
     resp.headers["Location"] = loc
     store_idempotent(resp)
     return resp
 
 @app.get("/loans/<loan_id>")
+@cached_response("loan:{loan_id}")
 def get_loan(loan_id):
     l = loans.get(loan_id)
     if not l: return jsonify({"error":"Không tìm thấy loan"}), 404
@@ -159,14 +396,25 @@ def get_loan(loan_id):
 
 @app.patch("/loans/<loan_id>")
 def return_loan(loan_id):
-    l = loans.get(loan_id)
-    if not l: return jsonify({"error":"Không tìm thấy loan"}), 404
-    if l["returned"]:
+    try:
+        returned = loans.compare_and_set(loan_id, "returned", False, True)
+    except KeyError:
+        return jsonify({"error":"Không tìm thấy loan"}), 404
+    if returned is None:   # đã trả trước đó
+        l = loans.get(loan_id)
         return jsonify(wrap(l, links={"self": url_for("get_loan", loan_id=loan_id)})), 200
-    l["returned"] = True
-    books[l["book_id"]]["available"] = True
-    books[l["book_id"]]["updated_at"] = time.time()
+    l = returned
+    books.update(l["book_id"], {"available": True, "updated_at": time.time()})
+    touch_book(l["book_id"])
+    touch_loan(loan_id)
     return jsonify(wrap(l, links={"self": url_for("get_loan", loan_id=loan_id)})), 200
 
+@app.cli.command("issue-token")
+@click.argument("subject")
+@click.option("--ttl", default=3600, show_default=True, help="Thời hạn (giây).")
+def issue_token_command(subject, ttl):
+    """Cấp token ký HMAC cho SUBJECT (in ra stdout)."""
+    click.echo(tokens.issue(subject, ttl))
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -1,6 +1,15 @@
-from flask import Flask, request, jsonify
-import base64, json
+from flask import Flask, Response, request, jsonify, g
+import base64, bisect, json, math, queue, sqlite3, sys, threading, time
+import click
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+from urllib.parse import urlencode
+
+# nén response dùng chung module với library-demos v1..v4
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "library-demos"))
+from common import compression
 
 app = Flask(__name__)
 
@@ -20,11 +29,248 @@ def seed_books(n=500):
     return data
 
 BOOKS = seed_books()
-TOTAL = len(BOOKS)
 
-# Luôn sort tăng theo id để phân trang ổn định
-def sorted_books():
-    return sorted(BOOKS, key=lambda b: b["id"])
+# ----- Chỉ mục sắp xếp theo id (duy trì khi thêm/xoá, không sort lại mỗi request) -----
+BOOKS_BY_ID = {b["id"]: b for b in BOOKS}
+SORTED_IDS = sorted(BOOKS_BY_ID)   # id tăng dần → phân trang ổn định
+_INDEX_LOCK = threading.Lock()
+# id lớn nhất từng cấp: chỉ tăng, kể cả khi sách mới nhất bị xoá, để client đang giữ
+# afterId của sách đã xoá không bỏ sót sách thêm sau đó
+_LAST_ID = SORTED_IDS[-1] if SORTED_IDS else 0
+
+# Chỉ mục phụ cho bộ lọc: author -> id tăng dần; (publishedAt, id) tăng dần
+AUTHOR_IDS = {}
+DATE_INDEX = []
+for _b in BOOKS:
+    AUTHOR_IDS.setdefault(_b["author"], []).append(_b["id"])
+    DATE_INDEX.append((_b["publishedAt"], _b["id"]))
+for _ids in AUTHOR_IDS.values():
+    _ids.sort()
+DATE_INDEX.sort()
+
+def total_books(ids=None) -> int:
+    return len(SORTED_IDS if ids is None else ids)
+
+def books_at(start: int, count: int, ids=None) -> list:
+    """Lấy `count` sách từ vị trí `start` trong thứ tự id: O(count)."""
+    ids = SORTED_IDS if ids is None else ids
+    return [BOOKS_BY_ID[i] for i in ids[start:start+count]]
+
+def position_after(after_id: int, ids=None) -> int:
+    """Vị trí của id đầu tiên > after_id (keyset seek): O(log n)."""
+    return bisect.bisect_right(SORTED_IDS if ids is None else ids, after_id)
+
+def insert_book(book: dict) -> dict:
+    """Thêm sách; thiếu "id" thì cấp id mới (không dùng lại id đã xoá). O(log n) tìm vị trí.
+
+    Mọi vị trí được tính trước khi sửa chỉ mục nào: giá trị sai kiểu (author không
+    hash được, publishedAt không so sánh được) ném lỗi mà các chỉ mục vẫn khớp nhau.
+    """
+    global _LAST_ID
+    with _INDEX_LOCK:
+        if book.get("id") is None:
+            book["id"] = _LAST_ID + 1
+        book_id = book["id"]
+        if book_id in BOOKS_BY_ID:
+            raise KeyError(book_id)
+        id_pos = bisect.bisect_left(SORTED_IDS, book_id)
+        author_ids = AUTHOR_IDS.get(book["author"], [])
+        author_pos = bisect.bisect_left(author_ids, book_id)
+        date_key = (book["publishedAt"], book_id)
+        date_pos = bisect.bisect_left(DATE_INDEX, date_key)
+
+        _LAST_ID = max(_LAST_ID, book_id)
+        BOOKS_BY_ID[book_id] = book
+        SORTED_IDS.insert(id_pos, book_id)
+        AUTHOR_IDS.setdefault(book["author"], author_ids).insert(author_pos, book_id)
+        DATE_INDEX.insert(date_pos, date_key)
+        _bump_version()
+        return book
+
+def remove_book(book_id: int) -> dict | None:
+    with _INDEX_LOCK:
+        book = BOOKS_BY_ID.pop(book_id, None)
+        if book is not None:
+            del SORTED_IDS[bisect.bisect_left(SORTED_IDS, book_id)]
+            author_ids = AUTHOR_IDS[book["author"]]
+            del author_ids[bisect.bisect_left(author_ids, book_id)]
+            if not author_ids:
+                del AUTHOR_IDS[book["author"]]
+            del DATE_INDEX[bisect.bisect_left(DATE_INDEX, (book["publishedAt"], book_id))]
+            ITEM_JSON.pop(book_id, None)
+            _bump_version()
+        return book
+
+# ----- Bộ lọc author / publishedFrom / publishedTo -----
+FILTER_CACHE_SIZE = 64
+_FILTER_CACHE = OrderedDict()   # filters -> (version, ids)
+
+def is_date(value) -> bool:
+    """Chuỗi dạng YYYY-MM-DD (dạng mà DATE_INDEX so sánh theo thứ tự chuỗi)."""
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return False
+    return len(value) == 10
+
+def parse_filters():
+    """Đọc bộ lọc từ query string -> (author, from, to) hoặc raise ValueError."""
+    author = request.args.get("author") or None
+    dates = []
+    for name in ("publishedFrom", "publishedTo"):
+        v = request.args.get(name) or None
+        if v is not None and not is_date(v):
+            raise ValueError(f"{name} phải có dạng YYYY-MM-DD")
+        dates.append(v)
+    return (author, dates[0], dates[1])
+
+def filter_query(filters) -> str:
+    """Phần query string của bộ lọc để gắn vào _links."""
+    pairs = [(k, v) for k, v in zip(("author", "publishedFrom", "publishedTo"), filters) if v]
+    return ("&" + urlencode(pairs)) if pairs else ""
+
+def _date_range(date_from, date_to):
+    lo = bisect.bisect_left(DATE_INDEX, (date_from,)) if date_from else 0
+    hi = bisect.bisect_right(DATE_INDEX, (date_to, math.inf)) if date_to else len(DATE_INDEX)
+    return lo, hi
+
+def filtered_ids(filters):
+    """Danh sách id (tăng dần) khớp bộ lọc, lấy từ chỉ mục phụ chứ không duyệt BOOKS.
+
+    Kết quả được nhớ theo DATA_VERSION nên các trang sau của cùng bộ lọc là O(1).
+    """
+    author, date_from, date_to = filters
+    if not any(filters):
+        return SORTED_IDS
+    if author and not (date_from or date_to):
+        return AUTHOR_IDS.get(author, [])
+
+    key = filters
+    with _INDEX_LOCK:
+        entry = _FILTER_CACHE.get(key)
+        if entry is not None and entry[0] == DATA_VERSION:
+            _FILTER_CACHE.move_to_end(key)
+            return entry[1]
+        version = DATA_VERSION
+        lo, hi = _date_range(date_from, date_to)
+        if not author:
+            ids = sorted(i for _, i in DATE_INDEX[lo:hi])
+        else:
+            # duyệt tập ứng viên nhỏ hơn trong hai chỉ mục
+            by_author = AUTHOR_IDS.get(author, [])
+            if len(by_author) <= hi - lo:
+                ids = [i for i in by_author
+                       if (not date_from or BOOKS_BY_ID[i]["publishedAt"] >= date_from)
+                       and (not date_to or BOOKS_BY_ID[i]["publishedAt"] <= date_to)]
+            else:
+                ids = sorted(i for _, i in DATE_INDEX[lo:hi] if BOOKS_BY_ID[i]["author"] == author)
+        _FILTER_CACHE[key] = (version, ids)
+        while len(_FILTER_CACHE) > FILTER_CACHE_SIZE:
+            _FILTER_CACHE.popitem(last=False)
+        return ids
+
+# ----- Nén response theo Accept-Encoding (zstd nếu có, gzip, deflate) -----
+compression.init_app(app)
+
+# ----- Cache JSON đã serialize sẵn -----
+# Mỗi sách được encode một lần thành fragment; cả trang (bytes) được cache theo
+# (strategy, tham số). Mọi thay đổi dữ liệu tăng DATA_VERSION → trang cũ tự hết hạn.
+DATA_VERSION = 0
+ITEM_JSON = {}   # id -> bytes
+PAGE_CACHE_SIZE = 256
+
+def _bump_version():
+    global DATA_VERSION
+    DATA_VERSION += 1
+
+def _dumps(obj) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def item_json(book: dict) -> bytes:
+    frag = ITEM_JSON.get(book["id"])
+    if frag is None:
+        frag = ITEM_JSON[book["id"]] = _dumps(book)
+    return frag
+
+class PageCache:
+    """LRU các trang JSON đã encode, gắn với DATA_VERSION lúc build.
+
+    Mỗi entry giữ thêm các bản nén theo encoding, tạo lần đầu có client xin.
+    """
+
+    def __init__(self, max_entries=PAGE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # key -> (version, body, {encoding: bytes})
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != DATA_VERSION:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def encoded(self, key, body: bytes, encoding) -> bytes:
+        """`body` (của entry `key`) nén bằng `encoding`; chỉ nén một lần mỗi entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[1] is not body:
+            return compression.compress(body, encoding)
+        data = entry[2].get(encoding)
+        if data is None:
+            data = entry[2][encoding] = compression.compress(body, encoding)
+        return data
+
+    def put(self, key, version, body: bytes) -> bytes:
+        with self._lock:
+            self._entries[key] = (version, body, {})
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return body
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRatio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": sum(len(body) + sum(map(len, enc.values()))
+                             for _, body, enc in self._entries.values()),
+                "maxEntries": self.max_entries,
+                "dataVersion": DATA_VERSION,
+            }
+
+PAGE_CACHE = PageCache()
+
+def render_page(items: list, meta: dict) -> bytes:
+    """Ghép fragment của từng sách với phần meta (pageInfo/_links/...) thành body."""
+    return b'{"items":[' + b",".join(item_json(b) for b in items) + b"]," + _dumps(meta)[1:]
+
+def page_response(key, build):
+    """Trả bytes đã cache cho `key`; nếu miss thì build() -> (items, meta) rồi cache."""
+    body = PAGE_CACHE.get(key)
+    if body is None:
+        version = DATA_VERSION
+        items, meta = build()
+        body = PAGE_CACHE.put(key, version, render_page(items, meta))
+    encoding = None
+    if len(body) >= compression.MIN_SIZE:
+        encoding = compression.negotiate(request.headers.get("Accept-Encoding", ""))
+    if encoding is None:
+        return Response(body, mimetype="application/json")
+    return compression.apply(Response(mimetype="application/json"), encoding,
+                             PAGE_CACHE.encoded(key, body, encoding))
 
 # ----- Helpers cho cursor -----
 def encode_cursor(obj: dict) -> str:
@@ -52,24 +298,31 @@ def list_books_offset():
     if limit < 1:  limit = 1
     if limit > 100: limit = 100  # chặn limit quá lớn
 
-    data = sorted_books()
-    slice_ = data[offset: offset+limit]
+    try:
+        filters = parse_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    fq = filter_query(filters)
 
-    return jsonify({
-        "items": slice_,
-        "pageInfo": {
-            "strategy": "offset",
-            "offset": offset,
-            "limit": limit,
-            "total": TOTAL,
-            "hasMore": (offset + limit) < TOTAL
-        },
-        "_links": {
-            "self":   {"href": f"/api/books.offset?offset={offset}&limit={limit}"},
-            "next":   {"href": f"/api/books.offset?offset={offset+limit}&limit={limit}"} if (offset+limit)<TOTAL else None,
-            "first":  {"href": f"/api/books.offset?offset=0&limit={limit}"},
+    def build():
+        ids = filtered_ids(filters)
+        total = total_books(ids)
+        return books_at(offset, limit, ids), {
+            "pageInfo": {
+                "strategy": "offset",
+                "offset": offset,
+                "limit": limit,
+                "total": total,
+                "hasMore": (offset + limit) < total
+            },
+            "_links": {
+                "self":   {"href": f"/api/books.offset?offset={offset}&limit={limit}{fq}"},
+                "next":   {"href": f"/api/books.offset?offset={offset+limit}&limit={limit}{fq}"} if (offset+limit)<total else None,
+                "first":  {"href": f"/api/books.offset?offset=0&limit={limit}{fq}"},
+            }
         }
-    })
+
+    return page_response(("offset", offset, limit, filters), build)
 # ----- 2) Page-based (page/size) -----
 @app.get("/api/books.page")
 def list_books_page():
@@ -83,29 +336,36 @@ def list_books_page():
     if size < 1: size = 1
     if size > 100: size = 100
 
-    offset = (page - 1) * size
-    data = sorted_books()
-    slice_ = data[offset: offset+size]
-    total_pages = (TOTAL + size - 1) // size
+    try:
+        filters = parse_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    fq = filter_query(filters)
 
-    return jsonify({
-        "items": slice_,
-        "pageInfo": {
-            "strategy": "page",
-            "page": page,
-            "size": size,
-            "total": TOTAL,
-            "totalPages": total_pages,
-            "hasMore": page < total_pages
-        },
-        "_links": {
-            "self":  {"href": f"/api/books.page?page={page}&size={size}"},
-            "next":  {"href": f"/api/books.page?page={page+1}&size={size}"} if page < total_pages else None,
-            "prev":  {"href": f"/api/books.page?page={page-1}&size={size}"} if page > 1 else None,
-            "first": {"href": f"/api/books.page?page=1&size={size}"},
-            "last":  {"href": f"/api/books.page?page={total_pages}&size={size}"}
+    def build():
+        ids = filtered_ids(filters)
+        offset = (page - 1) * size
+        total = total_books(ids)
+        total_pages = (total + size - 1) // size
+        return books_at(offset, size, ids), {
+            "pageInfo": {
+                "strategy": "page",
+                "page": page,
+                "size": size,
+                "total": total,
+                "totalPages": total_pages,
+                "hasMore": page < total_pages
+            },
+            "_links": {
+                "self":  {"href": f"/api/books.page?page={page}&size={size}{fq}"},
+                "next":  {"href": f"/api/books.page?page={page+1}&size={size}{fq}"} if page < total_pages else None,
+                "prev":  {"href": f"/api/books.page?page={page-1}&size={size}{fq}"} if page > 1 else None,
+                "first": {"href": f"/api/books.page?page=1&size={size}{fq}"},
+                "last":  {"href": f"/api/books.page?page={total_pages}&size={size}{fq}"}
+            }
         }
-    })
+
+    return page_response(("page", page, size, filters), build)
 
 # ----- 3) Cursor-based -----
 # Quy ước: sort theo id tăng; cursor chứa {"afterId": <id cuối trang trước>}
@@ -127,26 +387,244 @@ def list_books_cursor():
             return jsonify({"error": "cursor không hợp lệ"}), 400
         after_id = obj["afterId"]
 
-    data = sorted_books()
-    # Lấy các phần tử có id > after_id
-    filtered = [b for b in data if b["id"] > after_id]
-    slice_ = filtered[:limit]
+    try:
+        filters = parse_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def build():
+        ids = filtered_ids(filters)
+        # Seek thẳng tới id đầu tiên > after_id thay vì lọc cả danh sách
+        slice_ = books_at(position_after(after_id, ids), limit, ids)
+
+        # Tính nextCursor
+        if len(slice_) == limit and slice_:
+            next_cursor = encode_cursor({"afterId": slice_[-1]["id"]})
+        else:
+            next_cursor = None
+
+        return slice_, {
+            "pageInfo": {
+                "strategy": "cursor",
+                "limit": limit,
+                "total": total_books(ids),
+                "hasMore": next_cursor is not None
+            },
+            "nextCursor": next_cursor
+        }
+
+    return page_response(("cursor", after_id, limit, filters), build)
+
+# ----- 4) Keyset trên SQLite (cursor nhiều cột) -----
+# Mỗi kiểu sort có index khớp (cột sort, id) → trang sâu tốn như trang đầu,
+# khác OFFSET phải duyệt qua mọi dòng bị bỏ qua.
+DB_PATH = Path(__file__).with_name("books.db")
+KEYSET_SORTS = {
+    "id": ("id",),
+    "publishedAt": ("publishedAt", "id"),
+    "author": ("author", "id"),
+}
+BOOK_FIELDS = ("id", "isbn", "title", "author", "publishedAt")
+SEED_BATCH = 10_000
+_DB_POOL = queue.LifoQueue()       # connection rảnh, dùng lại giữa các request/thread
+_SCHEMA_LOCK = threading.Lock()
+_SCHEMA_READY = False
+
+def iter_seed_rows(n, start_id=1):
+    start = datetime(2010, 1, 1)
+    for i in range(start_id, start_id + n):
+        pub = start + timedelta(days=i % 5000)
+        yield (i, f"978-1-4028-{1000+i}", f"Book #{i}", f"Author {((i-1)%20)+1}", pub.strftime("%Y-%m-%d"))
+
+def init_db(db):
+    """Tạo bảng/index và seed lần đầu. Chạy MỘT lần mỗi process (ensure_db); seed
+    dùng id cố định + INSERT OR IGNORE nên nhiều process cùng seed không va nhau."""
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS books(
+            id INTEGER PRIMARY KEY,
+            isbn TEXT,
+            title TEXT NOT NULL,
+            author TEXT NOT NULL,
+            publishedAt TEXT NOT NULL
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_books_published ON books(publishedAt, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_books_author ON books(author, id)")
+    if db.execute("SELECT 1 FROM books LIMIT 1").fetchone() is None:
+        seed_db(db, len(BOOKS), start_id=1)
+    db.commit()
+
+def seed_db(db, n, batch=SEED_BATCH, start_id=None) -> int:
+    """Thêm n dòng giả từ start_id (mặc định: nối tiếp id lớn nhất hiện có); executemany theo lô."""
+    if start_id is None:
+        start_id = db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM books").fetchone()[0]
+    rows = iter_seed_rows(n, start_id)
+    while True:
+        chunk = list(islice(rows, batch))
+        if not chunk:
+            break
+        with db:
+            db.executemany(f"INSERT OR IGNORE INTO books({', '.join(BOOK_FIELDS)}) VALUES (?,?,?,?,?)", chunk)
+    return n
+
+def ensure_db():
+    global _SCHEMA_READY
+    if not _SCHEMA_READY:
+        with _SCHEMA_LOCK:
+            if not _SCHEMA_READY:
+                db = sqlite3.connect(DB_PATH)
+                try:
+                    init_db(db)
+                finally:
+                    db.close()
+                _SCHEMA_READY = True
+
+def get_db():
+    """Connection của request, lấy từ pool (server threaded mở mỗi request một thread
+    nên connection theo thread không được dùng lại); trả về pool ở teardown."""
+    db = g.get("keyset_db")
+    if db is None:
+        ensure_db()
+        try:
+            db = _DB_POOL.get_nowait()
+        except queue.Empty:
+            db = sqlite3.connect(DB_PATH, check_same_thread=False)
+        g.keyset_db = db
+    return db
+
+@app.teardown_appcontext
+def release_db(exc=None):
+    db = g.pop("keyset_db", None)
+    if db is not None:
+        if db.in_transaction:
+            db.rollback()
+        _DB_POOL.put(db)
+
+def keyset_query(sort: str, order: str, after, limit: int):
+    """SQL + tham số cho trang kế tiếp sau `after` (None = trang đầu).
 
-    # Tính nextCursor
-    if len(slice_) == limit and slice_:
-        next_cursor = encode_cursor({"afterId": slice_[-1]["id"]})
-    else:
-        next_cursor = None
+    Với khoá (a, id), điều kiện (a, id) > (x, y) được tách thành hai nhánh
+    `a = x AND id > y` và `a > x`, mỗi nhánh là một range seek trên index (a, id)
+    và tự dừng sau limit+1 dòng. Viết gộp thành so sánh row-value thì SQLite chỉ
+    seek theo cột a rồi lọc tuần tự qua mọi dòng cùng giá trị a.
+    """
+    cols = KEYSET_SORTS[sort]
+    op, direction = (">", "ASC") if order == "asc" else ("<", "DESC")
+    fields = ", ".join(BOOK_FIELDS)
+    order_by = ", ".join(f"{c} {direction}" for c in cols)
+    n = limit + 1
+    if after is None:
+        return f"SELECT {fields} FROM books ORDER BY {order_by} LIMIT {n}", ()
+    if len(cols) == 1:
+        return f"SELECT {fields} FROM books WHERE {cols[0]} {op} ? ORDER BY {order_by} LIMIT {n}", tuple(after)
+    lead, tie = cols[0], cols[1]
+    sql = (
+        f"SELECT {fields} FROM ("
+        f" SELECT * FROM (SELECT {fields} FROM books WHERE {lead} = ? AND {tie} {op} ?"
+        f"  ORDER BY {order_by} LIMIT {n})"
+        f" UNION ALL"
+        f" SELECT * FROM (SELECT {fields} FROM books WHERE {lead} {op} ?"
+        f"  ORDER BY {order_by} LIMIT {n})"
+        f") ORDER BY {order_by} LIMIT {n}"
+    )
+    return sql, (after[0], after[1], after[0])
+
+# Quy ước: cursor chứa {"sort", "order", "after": [giá trị các cột sort của dòng cuối]}
+@app.get("/api/books.keyset")
+def list_books_keyset():
+    try:
+        limit = int(request.args.get("limit", 20))
+    except ValueError:
+        return jsonify({"error": "limit phải là số nguyên"}), 400
+    if limit < 1: limit = 1
+    if limit > 100: limit = 100
+
+    sort = request.args.get("sort", "id")
+    order = request.args.get("order", "asc")
+    after = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        obj = decode_cursor(cursor)
+        if not isinstance(obj, dict) or not isinstance(obj.get("after"), list):
+            return jsonify({"error": "cursor không hợp lệ"}), 400
+        sort = obj.get("sort", sort)
+        order = obj.get("order", order)
+        after = obj["after"]
+        if not isinstance(sort, str) or not isinstance(order, str):
+            return jsonify({"error": "cursor không hợp lệ"}), 400
+    if sort not in KEYSET_SORTS:
+        return jsonify({"error": f"sort phải là một trong {', '.join(KEYSET_SORTS)}"}), 400
+    if order not in ("asc", "desc"):
+        return jsonify({"error": "order phải là asc hoặc desc"}), 400
+    cols = KEYSET_SORTS[sort]
+    if after is not None and (len(after) != len(cols) or not all(
+            isinstance(v, (int, str)) and not isinstance(v, bool) for v in after)):
+        return jsonify({"error": "cursor không hợp lệ"}), 400
+
+    sql, params = keyset_query(sort, order, after, limit)
+    rows = get_db().execute(sql, params).fetchall()
+    items = [dict(zip(BOOK_FIELDS, r)) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor({"sort": sort, "order": order, "after": [last[c] for c in cols]})
 
     return jsonify({
-        "items": slice_,
+        "items": items,
         "pageInfo": {
-            "strategy": "cursor",
+            "strategy": "keyset",
+            "sort": sort,
+            "order": order,
             "limit": limit,
             "hasMore": next_cursor is not None
         },
-        "nextCursor": next_cursor
+        "nextCursor": next_cursor,
+        "_links": {
+            "next": {"href": f"/api/books.keyset?limit={limit}&cursor={next_cursor}"} if next_cursor else None,
+        }
     })
 
+@app.cli.command("seed-db")
+@click.option("--rows", default=10_000_000, show_default=True, help="Số dòng thêm vào books.db")
+def seed_db_command(rows):
+    """Sinh dữ liệu lớn cho /api/books.keyset."""
+    db = get_db()
+    t0 = time.perf_counter()
+    seed_db(db, rows)
+    click.echo(f"Đã thêm {rows} dòng trong {time.perf_counter() - t0:.1f}s")
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    return jsonify(PAGE_CACHE.stats())
+
+# ----- Thêm / xoá (chỉ mục được cập nhật tại chỗ) -----
+@app.post("/api/books")
+def create_book():
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    title = data.get("title"); author = data.get("author"); published_at = data.get("publishedAt")
+    if not title or not author or not published_at:
+        return jsonify({"error": "Thiếu 'title'/'author'/'publishedAt'"}), 400
+    if not isinstance(author, str):
+        return jsonify({"error": "'author' phải là chuỗi"}), 400
+    if not is_date(published_at):
+        return jsonify({"error": "'publishedAt' phải có dạng YYYY-MM-DD"}), 400
+    book = insert_book({
+        "id": None,
+        "isbn": data.get("isbn"),
+        "title": title,
+        "author": author,
+        "publishedAt": published_at,
+    })
+    return jsonify(book), 201
+
+@app.delete("/api/books/<int:book_id>")
+def delete_book(book_id):
+    if remove_book(book_id) is None:
+        return jsonify({"error": "Không tìm thấy sách"}), 404
+    return "", 204
+
 if __name__ == "__main__":
     app.run(host="127.0.0.1", port=5000, debug=True)
\ No newline at end of file
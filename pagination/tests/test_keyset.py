@@ -0,0 +1,38 @@
+"""GET /api/books.keyset: cursor sai kiểu phải trả 400, không phải 500."""
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+APP = Path(__file__).resolve().parent.parent / "app.py"
+
+
+@pytest.fixture
+def pagination(tmp_path):
+    spec = importlib.util.spec_from_file_location("pagination_app", APP)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.DB_PATH = tmp_path / "books.db"
+    return module
+
+
+@pytest.mark.parametrize("cursor", [
+    {"sort": [], "after": [1]},
+    {"order": {}, "after": [1]},
+    {"sort": "id", "after": [[1]]},
+    {"sort": "id", "after": [True]},
+    {"sort": "author", "after": ["Author 1"]},
+])
+def test_malformed_cursor_is_rejected(pagination, cursor):
+    resp = pagination.app.test_client().get(
+        "/api/books.keyset", query_string={"cursor": pagination.encode_cursor(cursor)})
+    assert resp.status_code == 400
+    assert resp.get_json()["error"] == "cursor không hợp lệ"
+
+
+def test_next_cursor_round_trips(pagination):
+    c = pagination.app.test_client()
+    first = c.get("/api/books.keyset?sort=author&limit=5").get_json()
+    second = c.get("/api/books.keyset", query_string={"cursor": first["nextCursor"], "limit": 5}).get_json()
+    assert [b["id"] for b in first["items"]] != [b["id"] for b in second["items"]]
+    assert (second["pageInfo"]["sort"], len(second["items"])) == ("author", 5)